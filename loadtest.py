@@ -0,0 +1,298 @@
+"""Offline join-storm load generator for the welcome pipeline.
+
+Drives WelcomeBot.on_member_join with fake Guild / TextChannel / Member objects (no Discord connection) while a
+local HTTP server serves the avatars, then reports throughput, latency percentiles, memory growth and
+dropped welcomes. With --tenants, guilds are spread over several bots that share the process, each with
+its own store, the way BOT_TOKENS runs them.
+
+    python loadtest.py --joins 5000 --duration 60 --guilds 5
+    python loadtest.py --joins 200 --duration 10 --send-latency-ms 80 --animated-ratio 0.2 --json
+    python loadtest.py --joins 500 --duration 20 --duplicate-ratio 0.1
+    python loadtest.py --joins 2000 --duration 30 --guilds 12 --tenants 4
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+# Keep the harness's JSON files away from the real ones
+os.environ.setdefault("PERSISTENT_STORAGE_PATH", tempfile.mkdtemp(prefix="welcome-loadtest-"))
+
+import main  # noqa: E402  (must come after PERSISTENT_STORAGE_PATH is set)
+from report_stats import percentiles_ms  # noqa: E402
+
+# -----------------------
+# Local avatar server (own thread + loop, so blocking fetches on the bot loop can't deadlock it)
+# -----------------------
+def make_avatar(fmt: str, size: int) -> bytes:
+    rng = random.Random(size)
+    frames = 12 if fmt == "gif" else 1
+    images = []
+    for i in range(frames):
+        im = Image.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        draw = ImageDraw.Draw(im)
+        offset = i * size // (frames * 2)
+        draw.ellipse([offset, size // 4, offset + size // 2, 3 * size // 4], fill=(250, 200, 20))
+        images.append(im)
+    buf = BytesIO()
+    if fmt == "gif":
+        images[0].save(buf, "GIF", save_all=True, append_images=images[1:], duration=40, loop=0)
+    else:
+        images[0].save(buf, "JPEG" if fmt in ("jpg", "jpeg") else fmt.upper())
+    return buf.getvalue()
+
+class AvatarServer:
+    def __init__(self):
+        self.port = None
+        self.requests = 0
+        self._cache = {}
+        self._ready = threading.Event()
+        self._loop = None
+
+    async def _handle(self, request):
+        self.requests += 1
+        fmt = request.match_info["ext"].lower()
+        size = int(request.query.get("size", "512"))
+        key = (fmt, size)
+        if key not in self._cache:
+            self._cache[key] = make_avatar(fmt, size)
+        content_type = {"jpg": "image/jpeg", "jpeg": "image/jpeg"}.get(fmt, f"image/{fmt}")
+        return web.Response(body=self._cache[key], content_type=content_type)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_get("/avatars/{member_id}.{ext}", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self._run, name="avatar-server", daemon=True).start()
+        self._ready.wait()
+        return self
+
+# -----------------------
+# Fake discord objects (just the surface the welcome path touches)
+# -----------------------
+class FakeAsset:
+    def __init__(self, base: str, animated: bool, size: int = 1024, fmt: str = None):
+        self._base = base
+        self._animated = animated
+        self._size = size
+        self._format = fmt or ("gif" if animated else "png")
+
+    @property
+    def url(self):
+        return f"{self._base}.{self._format}?size={self._size}"
+
+    def is_animated(self):
+        return self._animated
+
+    def replace(self, size=None, format=None, static_format=None):
+        fmt = format or (static_format if not self._animated and static_format else None) or self._format
+        return FakeAsset(self._base, self._animated, size or self._size, fmt)
+
+    def with_size(self, size):
+        return self.replace(size=size)
+
+    def with_format(self, format):
+        return self.replace(format=format)
+
+    def with_static_format(self, format):
+        return self.replace(static_format=format)
+
+    def __str__(self):
+        return self.url
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, channel):
+        self.id = FakeMessage._next_id
+        FakeMessage._next_id += 1
+        self.channel = channel
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild, send_latency: float, stats):
+        self.id = channel_id
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.send_latency = send_latency
+        self.stats = stats
+
+    async def send(self, content=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.stats.delivered(content)
+        return FakeMessage(self)
+
+class FakeGuild:
+    def __init__(self, guild_id: int, send_latency: float, stats):
+        self.id = guild_id
+        self.name = f"Load Guild {guild_id}"
+        self.icon = None
+        self.members = []
+        self.member_count = 0
+        self.channel = FakeChannel(guild_id + 1, self, send_latency, stats)
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+    def get_member(self, member_id):
+        return None
+
+class FakeMember:
+    def __init__(self, member_id: int, guild: FakeGuild, avatar_base: str, animated: bool):
+        self.id = member_id
+        self.name = f"member{member_id}"
+        self.display_name = f"Load Tester {member_id}"
+        self.mention = f"<@{member_id}>"
+        self.guild = guild
+        self.bot = False
+        self.joined_at = discord_now()
+        self.display_avatar = FakeAsset(f"{avatar_base}/{member_id}", animated)
+
+def discord_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+# -----------------------
+# Storm driver + report
+# -----------------------
+class Stats:
+    def __init__(self):
+        self.join_times = {}   # mention -> perf_counter at join
+        self.latencies = []
+        self.duplicates = 0
+
+    def joined(self, member):
+        self.join_times[member.mention] = time.perf_counter()
+
+    def delivered(self, mention):
+        started = self.join_times.pop(mention, None)
+        if started is None:
+            self.duplicates += 1
+        else:
+            self.latencies.append(time.perf_counter() - started)
+
+async def run_storm(args):
+    server = AvatarServer().start()
+    avatar_base = f"http://127.0.0.1:{server.port}/avatars"
+    stats = Stats()
+    send_latency = args.send_latency_ms / 1000
+
+    clients = [main.WelcomeBot(store=main.TenantStore(os.path.join(main.PERSISTENT_PATH, f"tenant{i}")), name=f"tenant{i}")
+               for i in range(args.tenants)]
+    guilds = [FakeGuild(900_000_000_000_000_000 + i * 10, send_latency, stats) for i in range(args.guilds)]
+    owners = {}
+    for i, guild in enumerate(guilds):
+        client = owners[guild.id] = clients[i % len(clients)]
+        main.WELCOME_CHANNELS[guild.id] = guild.channel.id
+        if args.animated_ratio:
+            client.store.banner_themes[str(guild.id)] = {"animated": True}
+
+    rss_before = main.process_rss_bytes()
+    rss_peak = rss_before
+    rng = random.Random(args.seed)
+    interval = args.duration / max(1, args.joins)
+    tasks = []
+    replayed = 0
+    started = time.perf_counter()
+
+    for n in range(args.joins):
+        # Open-loop schedule: joins arrive on time no matter how far behind the bot is
+        delay = started + n * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        guild = guilds[n % len(guilds)]
+        member = FakeMember(1_000_000 + n, guild, avatar_base, rng.random() < args.animated_ratio)
+        guild.members.append(member)
+        guild.member_count += 1
+        stats.joined(member)
+        client = owners[guild.id]
+        tasks.append(asyncio.create_task(client.on_member_join(member)))
+        if rng.random() < args.duplicate_ratio:
+            # Replay the same GUILD_MEMBER_ADD while the first is still in flight, as a gateway resume can
+            replayed += 1
+            tasks.append(asyncio.create_task(client.on_member_join(member)))
+        if n % 100 == 0:
+            rss_peak = max(rss_peak, main.process_rss_bytes())
+
+    done, pending = await asyncio.wait(tasks, timeout=args.drain_timeout) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+    await main.http_client.close()
+    for client in clients:
+        client.store.flush()
+    elapsed = time.perf_counter() - started
+    rss_after = main.process_rss_bytes()
+    rss_peak = max(rss_peak, rss_after)
+
+    latencies = sorted(stats.latencies)
+    return {
+        "joins": args.joins,
+        "guilds": args.guilds,
+        "tenants": args.tenants,
+        "offered_rate_per_s": round(args.joins / args.duration, 2) if args.duration else None,
+        "delivered": len(latencies),
+        "dropped": len(stats.join_times),
+        "timed_out": len(pending),
+        "replayed_joins": replayed,
+        "duplicate_sends": stats.duplicates,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles_ms(latencies),
+        "avatar_requests": server.requests,
+        "rss_mb": {"before": round(rss_before / 2**20, 1), "after": round(rss_after / 2**20, 1),
+                   "peak": round(rss_peak / 2**20, 1), "growth": round((rss_after - rss_before) / 2**20, 1)},
+    }
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a join storm against the welcome pipeline, offline.")
+    parser.add_argument("--joins", type=int, default=500, help="total joins to replay")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds over which joins arrive")
+    parser.add_argument("--guilds", type=int, default=3, help="number of fake guilds to spread joins across")
+    parser.add_argument("--tenants", type=int, default=1, help="bots sharing the process; guilds are dealt out round-robin")
+    parser.add_argument("--send-latency-ms", type=float, default=50.0, help="simulated channel.send latency")
+    parser.add_argument("--animated-ratio", type=float, default=0.0, help="fraction of members with animated avatars")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="fraction of joins whose event is replayed")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="seconds to wait for in-flight welcomes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's per-join INFO logging")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.getLogger("WelcomeBot").setLevel(logging.WARNING)
+    main.TRACE_SAMPLE_RATE = 0.0
+    report = asyncio.run(run_storm(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    lat = report["latency_ms"]
+    print(f"Joins: {report['joins']} across {report['guilds']} guild(s) on {report['tenants']} tenant(s) in {report['elapsed_s']}s")
+    print(f"Delivered: {report['delivered']}  dropped: {report['dropped']}  timed out: {report['timed_out']}  "
+          f"duplicate sends: {report['duplicate_sends']} (of {report['replayed_joins']} replayed joins)")
+    print(f"Throughput: {report['throughput_per_s']}/s (offered {report['offered_rate_per_s']}/s)")
+    print(f"Join->post latency ms: p50 {lat['p50']}  p90 {lat['p90']}  p99 {lat['p99']}  max {lat['p100']}")
+    rss = report["rss_mb"]
+    print(f"RSS MB: {rss['before']} -> {rss['after']} (peak {rss['peak']}, growth {rss['growth']})")
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
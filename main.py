@@ -4,43 +4,720 @@ from discord import File
 from discord import app_commands
 import aiohttp
 import asyncio
+import atexit
+import gc
+import inspect
 import os
 import json
 import random
-from datetime import datetime
+import re
+import struct
+import sys
+import unicodedata
+import threading
+import time
+import traceback
+import tracemalloc
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+from typing import Mapping, NamedTuple
+from urllib.parse import urlsplit
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import requests
 from io import BytesIO
+from queue import Full, Queue
 from dotenv import load_dotenv
 
 # -----------------------
 # Load env + logging
 # -----------------------
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger('WelcomeBot')
+logger = logging.getLogger('WelcomeBot')  # handlers are installed by setup_logging() below
 
 # -----------------------
 # Config
 # -----------------------
 class Config:
-    def __init__(self):
-        self.bot_token = os.getenv('BOT_TOKEN')
-        self.webhook_url = os.getenv('WEBHOOK_URL', None)
+    def __init__(self, bot_token: str = None, env_prefix: str = ""):
+        # Tenants in BOT_TOKENS read their own <NAME>_WEBHOOK_URL / <NAME>_GUILD_ID
+        self.bot_token = bot_token or os.getenv('BOT_TOKEN')
+        self.webhook_url = os.getenv(env_prefix + 'WEBHOOK_URL', None)
+        # Guild that WEBHOOK_URL delivers welcomes for (other guilds use /set_welcome_webhook)
+        self.guild_id = os.getenv(env_prefix + 'GUILD_ID', None)
 
     def validate(self):
         if not self.bot_token:
             raise ValueError("BOT_TOKEN environment variable is required")
         return True
 
+# -----------------------
+# Metrics (Prometheus text format, served from a background thread)
+# -----------------------
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the endpoint
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Metric:
+    """A metric family with optional labels. Updates take a short lock so the HTTP thread reads a consistent view."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + self._format_labels(k), v) for k, v in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name} {value!r}" for name, value in self.samples()]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function  # evaluated at scrape time; must be safe to call from another thread
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            return [(self.name, float(self._function()))]
+        except Exception:
+            return []
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, count, total) in self._values.items():
+                for bound, c in zip(self.buckets, counts):
+                    out.append((self.name + "_bucket" + self._format_labels(key, [("le", repr(bound))]), c))
+                out.append((self.name + "_bucket" + self._format_labels(key, [("le", "+Inf")]), count))
+                out.append((self.name + "_count" + self._format_labels(key), count))
+                out.append((self.name + "_sum" + self._format_labels(key), total))
+        return out
+
+METRICS = []
+
+def render_metrics():
+    return "\n".join(m.render() for m in METRICS) + "\n"
+
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+JOIN_TO_POST_SECONDS = Histogram("welcome_join_to_post_seconds", "Time from member join to welcome posted")
+BANNER_RENDER_SECONDS = Histogram("welcome_banner_render_seconds", "Banner composition time", ["kind"])
+BANNER_ENCODE_SECONDS = Histogram("welcome_banner_encode_seconds", "Banner PNG/GIF encode time", ["kind"])
+AVATAR_FETCH_SECONDS = Histogram("welcome_avatar_fetch_seconds", "Avatar download time")
+WELCOMES_TOTAL = Counter("welcomes_total", "Welcome messages by guild and outcome", ["guild", "status", "via"])
+RATE_LIMIT_HITS = Counter("discord_rate_limit_hits_total", "HTTP 429 responses from Discord", ["source"])
+WELCOMES_IN_FLIGHT = Gauge("welcomes_in_flight", "Joins currently being processed")
+FANOUT_IN_FLIGHT = Gauge("fanout_sends_in_flight", "Fan-out sends queued or in progress")
+ASYNCIO_TASKS = Gauge("asyncio_tasks", "Tasks alive on the event loop")
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "Most recent event-loop scheduling lag")
+PROCESS_RSS = Gauge("process_resident_memory_bytes", "Resident set size", function=process_rss_bytes)
+
+# discord.py 2.3's log templates: every 429 logs one of the first two; a global one then also logs the third
+DISCORD_429_TEMPLATES = (
+    "We are being rate limited. %s %s responded with 429. Retrying in %.2f seconds.",
+    "We are being rate limited. %s %s responded with 429. Timeout of %.2f was too long, erroring instead.",
+)
+DISCORD_GLOBAL_429_TEMPLATE = "Global rate limit has been hit. Retrying in %.2f seconds."
+
+class RateLimitLogCounter(logging.Filter):
+    """Counts discord.py's own 429s (it retries internally, so its warnings are the only signal), once each.
+
+    The global warning follows the 429 warning synchronously, so the count waits for the next loop iteration:
+    by then it is known whether the 429 was global.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pending = None  # source label of the 429 not counted yet
+
+    def filter(self, record):
+        if record.msg in DISCORD_429_TEMPLATES:
+            self._count_pending()
+            self._pending = "bot"
+            try:
+                asyncio.get_running_loop().call_soon(self._count_pending)
+            except RuntimeError:
+                self._count_pending()
+        elif record.msg == DISCORD_GLOBAL_429_TEMPLATE:
+            if self._pending:
+                self._pending = "global"
+            else:
+                RATE_LIMIT_HITS.inc(source="global")
+        return True
+
+    def _count_pending(self):
+        if self._pending:
+            RATE_LIMIT_HITS.inc(source=self._pending)
+            self._pending = None
+
+logging.getLogger("discord.http").addFilter(RateLimitLogCounter())
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Serve /metrics on a daemon thread. The handler only reads lock-protected metric state, so it never touches the loop."""
+    from flask import Flask, Response  # only needed when metrics are enabled
+    from werkzeug.serving import make_server
+
+    app = Flask("welcome-metrics")
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no INFO access line for every scrape
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    server = make_server("0.0.0.0", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics endpoint listening on :%d/metrics", port)
+    return server
+
+# -----------------------
+# Logging (queue + background writer thread, so a slow stdout never blocks the loop)
+# -----------------------
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "json" for one JSON object per line
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))  # WARNING+ records per logger and message per window
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped before reaching the writer", ["reason"])
+
+class LazyJson:
+    """A payload serialised only when the writer thread formats it: logger.info("%s", LazyJson(payload))."""
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return json.dumps(self.payload, default=str)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        args = record.args
+        if record.msg == "%s" and isinstance(args, tuple) and len(args) == 1 and isinstance(args[0], LazyJson):
+            entry.update(args[0].payload)  # structured payloads (traces) stay objects instead of a string in a string
+        else:
+            entry["msg"] = record.getMessage()
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogRateLimiter(logging.Filter):
+    """Lets at most `limit` WARNING+ records through per (logger, message template) per `window` seconds.
+
+    Runs on the calling thread before anything is formatted or queued, so a flood costs a dict lookup per call.
+    The first record of the next window says how many were dropped.
+    """
+
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW, level: int = logging.WARNING):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.level = level
+        self._windows = {}  # (logger, template) -> [window_start, passed, dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level or self.limit <= 0:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or record.created - state[0] >= self.window:
+                dropped = state[2] if state else 0
+                if len(self._windows) > 1000:
+                    self._prune(record.created)
+                self._windows[key] = [record.created, 1, 0]
+                if dropped and isinstance(record.msg, str):
+                    record.msg += f" [{dropped} similar message(s) suppressed]"
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+        LOG_RECORDS_DROPPED.inc(reason="rate_limited")
+        return False
+
+    def _prune(self, now: float):
+        for key in [k for k, (start, _, _) in self._windows.items() if now - start >= self.window]:
+            del self._windows[key]
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread untouched: message formatting happens there, not on the event loop.
+
+    When the queue is full the record is dropped (and counted) rather than making the caller wait.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(logging.BASIC_FORMAT))
+log_queue_handler = NonBlockingQueueHandler(Queue(LOG_QUEUE_SIZE))
+log_queue_handler.addFilter(LogRateLimiter())
+log_listener = None
+
+def start_log_writer():
+    """(Re)start the writer thread on a fresh queue. Also runs in forked children (render_batch.py workers),
+    which inherit the handler but not the thread."""
+    global log_listener
+    log_queue_handler.queue = Queue(LOG_QUEUE_SIZE)
+    log_listener = QueueListener(log_queue_handler.queue, log_stream_handler, respect_handler_level=True)
+    log_listener.start()
+
+def setup_logging():
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    if log_queue_handler not in root.handlers:
+        root.addHandler(log_queue_handler)
+    start_log_writer()
+    atexit.register(lambda: log_listener.stop())  # drains whatever is still queued
+    os.register_at_fork(after_in_child=start_log_writer)
+
+setup_logging()
+
+LOOP_MONITOR_INTERVAL = 0.1
+
+async def monitor_event_loop(interval: float = LOOP_MONITOR_INTERVAL):
+    loop = asyncio.get_running_loop()
+    loop_watchdog.loop_thread_id = threading.get_ident()
+    while True:
+        loop_watchdog.heartbeat = time.monotonic()
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - started - interval))
+        ASYNCIO_TASKS.set(len(asyncio.all_tasks(loop)))
+
+# -----------------------
+# Event-loop stall watchdog
+# -----------------------
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "250"))  # 0 disables the watchdog
+LOOP_STALL_TOP_N = 10
+LOOP_STALLS = Counter("event_loop_stalls_total", "Event-loop stalls over LOOP_STALL_THRESHOLD_MS by handler", ["handler"])
+
+class LoopWatchdog:
+    """Background thread that notices when the event loop stops ticking.
+
+    monitor_event_loop() refreshes `heartbeat` every tick. When a tick is overdue by more than the threshold,
+    the loop thread's stack is captured, attributed to the outermost handler in this file (the event or
+    command callback that was running) and the innermost line here, and kept in a rolling top-N.
+    """
+
+    def __init__(self, threshold_ms: float = LOOP_STALL_THRESHOLD_MS, poll_interval: float = 0.05):
+        self.threshold = threshold_ms / 1000
+        self.poll_interval = poll_interval
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.offenders = {}  # (handler, location) -> {"count", "total_ms", "max_ms", "stack", "last_seen"}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.threshold > 0:
+            self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        stall = None  # (key, stack, heartbeat it started from)
+        while not self._stop.wait(self.poll_interval):
+            beat = self.heartbeat
+            lag = time.monotonic() - beat - LOOP_MONITOR_INTERVAL
+            if stall and stall[2] != beat:
+                # Loop is ticking again: the stall lasted until this heartbeat
+                self._record(stall[0], stall[1], (beat - stall[2]) * 1000)
+                stall = None
+            if stall is None and lag > self.threshold and self.loop_thread_id:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    key, stack = self._attribute(frame)
+                    logger.warning("Event loop blocked for %.0f+ ms in %s at %s:\n%s", lag * 1000, key[0], key[1], stack)
+                    stall = (key, stack, beat)
+
+    @staticmethod
+    def _attribute(frame):
+        stack = traceback.extract_stack(frame)
+        ours = [f for f in stack if f.filename == __file__ and f.name not in ("main", "monitor_event_loop")]
+        handler = ours[0].name if ours else "unknown"
+        location = f"{ours[-1].name}:{ours[-1].lineno}" if ours else f"{stack[-1].name}:{stack[-1].lineno}"
+        blocking = stack[-1]
+        location += f" -> {os.path.basename(blocking.filename)}:{blocking.lineno} {blocking.name}"
+        return (handler, location), "".join(traceback.format_list(stack[-12:]))
+
+    def _record(self, key, stack, stalled_ms: float):
+        LOOP_STALLS.inc(handler=key[0])
+        with self._lock:
+            entry = self.offenders.setdefault(key, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "stack": stack})
+            entry["count"] += 1
+            entry["total_ms"] += stalled_ms
+            entry["max_ms"] = max(entry["max_ms"], stalled_ms)
+            entry["stack"] = stack
+            entry["last_seen"] = time.time()
+            if len(self.offenders) > LOOP_STALL_TOP_N * 5:
+                for stale in sorted(self.offenders, key=lambda k: self.offenders[k]["total_ms"])[:LOOP_STALL_TOP_N]:
+                    del self.offenders[stale]
+
+    def top(self, n: int = LOOP_STALL_TOP_N):
+        with self._lock:
+            ranked = sorted(self.offenders.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)[:n]
+            return [(key, dict(entry)) for key, entry in ranked]
+
+loop_watchdog = LoopWatchdog()
+
+# -----------------------
+# Per-join trace spans (JSON log lines, head-sampled + tail capture of slow joins)
+# -----------------------
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "3000"))
+trace_logger = logging.getLogger("WelcomeBot.trace")
+
+class JoinTrace:
+    """Collects timed spans for one welcome. Nothing is logged until finish(), so the keep/drop decision can
+    look at the whole trace: sampled traces, slow ones (>= TRACE_SLOW_MS) and failed ones are emitted."""
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+        self.started = time.perf_counter()
+        self.start_ts = time.time()
+        self.spans = []
+        self._stack = [self.trace_id]
+        self._lock = threading.Lock()
+        self.finished = False
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        span_id = os.urandom(4).hex()
+        parent_id = self._stack[-1]
+        self._stack.append(span_id)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._stack.pop()
+            record = {
+                "span_id": span_id, "parent_id": parent_id, "name": name,
+                "offset_ms": round((started - self.started) * 1000, 2),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            if attrs:
+                record["attrs"] = attrs
+            if error:
+                record["error"] = error
+            with self._lock:
+                self.spans.append(record)
+
+    def finish(self, status: str = "ok"):
+        if self.finished:
+            return
+        self.finished = True
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        slow = duration_ms >= TRACE_SLOW_MS
+        if not (self.sampled or slow or status != "ok"):
+            return
+        reason = "error" if status != "ok" else "slow" if slow else "sampled"
+        root = {
+            "trace_id": self.trace_id, "span_id": self.trace_id, "name": self.name, "start": self.start_ts,
+            "duration_ms": round(duration_ms, 2), "status": status, "capture": reason, "attrs": self.attrs,
+        }
+        trace_logger.info("%s", LazyJson(root))
+        for record in sorted(self.spans, key=lambda r: r["offset_ms"]):
+            trace_logger.info("%s", LazyJson({"trace_id": self.trace_id, **record}))
+
+class _NullTrace:
+    trace_id = None
+
+    @contextmanager
+    def span(self, name, **attrs):
+        yield attrs
+
+    def finish(self, status="ok"):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+# -----------------------
+# Deferred interactions (ack first, work in a tracked background task)
+# -----------------------
+DEFERRED_COMMAND_TIMEOUT = float(os.getenv("DEFERRED_COMMAND_TIMEOUT", "60"))
+INTERACTION_ACK_SECONDS = Histogram("interaction_ack_seconds", "Interaction creation to acknowledgement", ["command"])
+DEFERRED_COMMAND_SECONDS = Histogram("deferred_command_seconds", "Background run time of deferred commands", ["command", "outcome"])
+command_tasks = set()
+
+def deferred_command(timeout: float = DEFERRED_COMMAND_TIMEOUT, ephemeral: bool = True):
+    """Acknowledge the interaction straight away, then run the command body as a background task.
+
+    The body must answer through interaction.followup. Timeouts and unhandled errors are reported to the
+    invoking admin, and the acknowledge latency is recorded per command.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            name = interaction.command.name if interaction.command else func.__name__
+            await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+            ack = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+            INTERACTION_ACK_SECONDS.observe(ack, command=name)
+            if ack > 2.0:
+                logger.warning("/%s acknowledged after %.2fs", name, ack)
+            task = asyncio.create_task(_run_deferred(func, name, timeout, interaction, args, kwargs), name=f"command:{name}")
+            command_tasks.add(task)
+            task.add_done_callback(command_tasks.discard)
+        return wrapper
+    return decorator
+
+async def _run_deferred(func, name, timeout, interaction, args, kwargs):
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        await asyncio.wait_for(func(interaction, *args, **kwargs), timeout)
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.warning("/%s timed out after %gs", name, timeout)
+        await _safe_followup(interaction, f"❌ `/{name}` timed out after {timeout:g}s.")
+    except Exception:
+        outcome = "error"
+        logger.exception("/%s failed", name)
+        await _safe_followup(interaction, f"❌ `/{name}` failed. See logs.")
+    finally:
+        DEFERRED_COMMAND_SECONDS.observe(time.perf_counter() - started, command=name, outcome=outcome)
+
+async def _safe_followup(interaction: discord.Interaction, content: str):
+    try:
+        await interaction.followup.send(content, ephemeral=True)
+    except discord.HTTPException:
+        pass  # interaction token expired (15 min) or the followup itself failed
+
+# -----------------------
+# Outbound HTTP (one pooled session for avatars, relayed images and webhooks)
+# -----------------------
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "15"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = 0.25  # seconds; attempt n sleeps uniform(0, min(cap, base * 2**n))
+HTTP_BACKOFF_CAP = 4.0    # also the longest Retry-After we'll sleep through before handing the response back
+HTTP_DNS_TTL = 300
+HTTP_KEEPALIVE = 30
+HTTP_METRIC_HOSTS = 20    # distinct host labels before the rest are reported as "other"
+HTTP_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+HTTP_REQUESTS = Counter("http_client_requests_total", "Outbound HTTP requests by host and status", ["host", "status"])
+HTTP_REQUEST_SECONDS = Histogram("http_client_request_seconds", "Outbound HTTP request time by host", ["host"])
+HTTP_RETRIES_TOTAL = Counter("http_client_retries_total", "Outbound HTTP retries by host and reason", ["host", "reason"])
+
+class HttpError(Exception):
+    """The request failed after all retries, or the body was larger than the caller allowed."""
+
+class HttpResponse(NamedTuple):
+    status: int
+    headers: Mapping[str, str]  # case-insensitive (aiohttp's CIMultiDictProxy)
+    content: bytes
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content or b"null")
+
+class HttpClient:
+    """Shared aiohttp session: keep-alive pool, cached DNS, per-host connection cap, bounded jittered retries.
+
+    The session is opened lazily on first use, so code driven outside the bot (loadtest.py) gets the
+    same client. Bodies are read fully before returning; pass max_bytes to refuse oversized downloads.
+    """
+
+    def __init__(self):
+        self.session = None
+        self._hosts = set()
+        self._in_flight = 0  # requests holding a pooled connection right now
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS, limit_per_host=HTTP_PER_HOST_LIMIT,
+                                             ttl_dns_cache=HTTP_DNS_TTL, keepalive_timeout=HTTP_KEEPALIVE,
+                                             enable_cleanup_closed=True)
+            timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def connection_count(self) -> int:
+        """Connections currently checked out of the pool by in-flight requests (idle keep-alives aren't counted)."""
+        return self._in_flight
+
+    def _host_label(self, url: str) -> str:
+        host = urlsplit(url).hostname or "unknown"
+        if host not in self._hosts:
+            if len(self._hosts) >= HTTP_METRIC_HOSTS:
+                return "other"
+            self._hosts.add(host)
+        return host
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after=None) -> float:
+        delay = random.uniform(0, min(HTTP_BACKOFF_CAP, HTTP_BACKOFF_BASE * 2 ** attempt))
+        try:
+            return max(delay, float(retry_after)) if retry_after is not None else delay
+        except ValueError:
+            return delay  # HTTP-date Retry-After; not worth parsing for the hosts we talk to
+
+    @staticmethod
+    async def _read(resp, max_bytes):
+        if not max_bytes:
+            return await resp.read()
+        if resp.content_length and resp.content_length > max_bytes:
+            raise HttpError(f"response is {resp.content_length} bytes (limit {max_bytes})")
+        chunks, size = [], 0
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HttpError(f"response exceeds {max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def request(self, method: str, url: str, *, retries: int = HTTP_RETRIES, max_bytes: int = None, **kwargs) -> HttpResponse:
+        """Send a request and return the buffered response. Retries 429/5xx and transport errors.
+
+        Only retry idempotent requests: a consumed aiohttp.FormData can't be sent twice, so POSTs pass retries=0.
+        Raises HttpError when the last attempt fails at the transport level or max_bytes is exceeded.
+        """
+        session = await self.start()
+        host = self._host_label(url)
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            try:
+                self._in_flight += 1
+                try:
+                    async with session.request(method, url, **kwargs) as resp:
+                        response = HttpResponse(resp.status, resp.headers, await self._read(resp, max_bytes))
+                finally:
+                    self._in_flight -= 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, host=host)
+                HTTP_REQUESTS.inc(host=host, status="error")
+                if attempt == retries:
+                    raise HttpError(f"{method} {host} failed: {type(e).__name__}: {e}") from e
+                reason, delay = "error", self._backoff(attempt)
+            else:
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, host=host)
+                HTTP_REQUESTS.inc(host=host, status=str(response.status))
+                if response.status not in HTTP_RETRY_STATUSES or attempt == retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                if delay > HTTP_BACKOFF_CAP:
+                    return response  # let the caller decide rather than parking a welcome for a long Retry-After
+                reason = str(response.status)
+            HTTP_RETRIES_TOTAL.inc(host=host, reason=reason)
+            logger.debug("Retrying %s %s in %.2fs (%s, attempt %d/%d)", method, host, delay, reason, attempt + 1, retries)
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("GET", url, **kwargs)
+
+http_client = HttpClient()
+
 # -----------------------
 # Storage paths
 # -----------------------
 PERSISTENT_PATH = os.getenv("PERSISTENT_STORAGE_PATH", ".")
 os.makedirs(PERSISTENT_PATH, exist_ok=True)
-WELCOME_FILE = os.path.join(PERSISTENT_PATH, "welcome_messages.json")
-SENT_EMBEDS_FILE = os.path.join(PERSISTENT_PATH, "sent_embeds.json")
 
 # -----------------------
 # Helper: JSON persistence
@@ -51,7 +728,7 @@ def load_json(path, default):
             with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
     except Exception as e:
-        logger.error(f"Failed to load {path}: {e}")
+        logger.error("Failed to load %s: %s", path, e)
     return default
 
 def save_json(path, data):
@@ -59,10 +736,124 @@ def save_json(path, data):
         with open(path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
     except Exception as e:
-        logger.error(f"Failed to save {path}: {e}")
+        logger.error("Failed to save %s: %s", path, e)
 
-welcome_messages = load_json(WELCOME_FILE, {})
-sent_embeds = load_json(SENT_EMBEDS_FILE, {})
+# -----------------------
+# Sent-embed index (per guild / per channel, ordered by send time)
+# -----------------------
+class SentEmbedIndex:
+    """Secondary indexes over sent_embeds: sorted message IDs per guild and per channel.
+
+    Snowflakes grow with send time, so ID order is chronological and date bounds turn into ID bounds;
+    a page is two bisects and a slice, however large the registry gets.
+    """
+
+    def __init__(self):
+        self.by_guild = {}
+        self.by_channel = {}
+
+    def rebuild(self, registry: dict):
+        self.by_guild.clear()
+        self.by_channel.clear()
+        for message_id, info in registry.items():
+            self.by_guild.setdefault(info.get("guild_id"), []).append(int(message_id))
+            self.by_channel.setdefault(info.get("channel_id"), []).append(int(message_id))
+        for ids in (*self.by_guild.values(), *self.by_channel.values()):
+            ids.sort()
+
+    def add(self, message_id: int, guild_id: int, channel_id: int):
+        for index, key in ((self.by_guild, guild_id), (self.by_channel, channel_id)):
+            ids = index.setdefault(key, [])
+            if not ids or ids[-1] < message_id:
+                ids.append(message_id)  # the normal case: a message newer than everything recorded
+            else:
+                pos = bisect_left(ids, message_id)
+                if pos == len(ids) or ids[pos] != message_id:
+                    ids.insert(pos, message_id)
+
+    def page(self, guild_id: int, channel_id: int = None, before: int = None, after: int = None, limit: int = 10):
+        """Newest-first message IDs strictly between after and before.
+
+        Returns (ids, cursor); pass cursor back as before= for the next (older) page. cursor is None on the last page.
+        """
+        ids = self.by_channel.get(channel_id, []) if channel_id else self.by_guild.get(guild_id, [])
+        hi = bisect_left(ids, before) if before is not None else len(ids)
+        lo = bisect_right(ids, after) if after is not None else 0
+        start = max(lo, hi - limit)
+        return ids[start:hi][::-1], (ids[start] if start > lo else None)
+
+# -----------------------
+# Per-tenant state (one TenantStore per bot token)
+# -----------------------
+STORE_FLUSH_DELAY = 2.0  # seconds; coalesces a join storm's mark / dedupe updates into one write
+
+class TenantStore:
+    """A bot's persisted JSON state and the in-memory indexes built from it, all under one directory.
+
+    Single-token mode uses PERSISTENT_PATH itself, so existing deployments keep their files where they are.
+    """
+    FILES = ("welcome_messages", "sent_embeds", "channel_groups", "welcome_webhooks", "banner_themes", "join_marks",
+             "join_dedupe")
+
+    def __init__(self, path: str = PERSISTENT_PATH):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.welcome_messages = load_json(self.file("welcome_messages"), {})
+        self.sent_embeds = load_json(self.file("sent_embeds"), {})
+        self.channel_groups = load_json(self.file("channel_groups"), {})
+        self.welcome_webhooks = load_json(self.file("welcome_webhooks"), {})
+        self.banner_themes = load_json(self.file("banner_themes"), {})
+        self.join_marks = load_json(self.file("join_marks"), {})
+        self.sent_embed_index = SentEmbedIndex()
+        self.sent_embed_index.rebuild(self.sent_embeds)
+        if JOIN_DEDUPE_PERSIST:
+            self.join_dedupe = JoinDedupe(load_json(self.file("join_dedupe"), {}), on_change=lambda: self.save_later("join_dedupe"))
+        else:
+            self.join_dedupe = JoinDedupe()
+        self.render_plans = {}
+        self.welcomed_this_session = {}  # guild_id -> set(member_id); survives reconnects, so a re-fired on_ready can't double up
+        self.retry_from = {}  # guild_id -> joined_at of the earliest failed welcome; the mark stays below it
+        self.catchup_lock = asyncio.Lock()
+        self._flush_handles = {}
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.json")
+
+    def save(self, name: str):
+        assert name in self.FILES, name
+        handle = self._flush_handles.pop(name, None)
+        if handle is not None:
+            handle.cancel()
+        state = getattr(self, name)
+        save_json(self.file(name), state.entries if isinstance(state, JoinDedupe) else state)
+
+    def save_later(self, name: str, delay: float = STORE_FLUSH_DELAY):
+        """Write `name` once after `delay`, however many times it changes meanwhile (keeps json.dump off hot paths)."""
+        if name in self._flush_handles:
+            return
+        try:
+            self._flush_handles[name] = asyncio.get_running_loop().call_later(delay, self.save, name)
+        except RuntimeError:
+            self.save(name)  # no running loop (offline scripts): write straight away
+
+    def flush(self):
+        for name in list(self._flush_handles):
+            self.save(name)
+
+def record_sent_embed(store: TenantStore, message: discord.Message, embeds=(), group_id: str = None, part: int = None, parts: int = None):
+    """Register a sent embed message in store.sent_embeds and its indexes. The caller saves sent_embeds.
+
+    Messages split from one oversized post share a group_id and carry their part number out of parts.
+    """
+    channel = message.channel
+    info = {"guild_id": channel.guild.id, "channel_id": channel.id}
+    title = next((e.title for e in embeds if e.title), None)
+    if title:
+        info["title"] = title[:100]
+    if group_id:
+        info.update(group_id=group_id, part=part, parts=parts)
+    store.sent_embeds[str(message.id)] = info
+    store.sent_embed_index.add(message.id, channel.guild.id, channel.id)
 
 # -----------------------
 # Multi-guild welcome channels
@@ -86,220 +877,1232 @@ DEFAULT_MESSAGES = [
    "Welcome {mention}! Great to have you here!"
 ]
 
-def get_guild_messages(guild_id: int):
+def get_guild_messages(store: TenantStore, guild_id: int):
     guild_id_str = str(guild_id)
-    if guild_id_str in welcome_messages and welcome_messages[guild_id_str]:
-        return welcome_messages[guild_id_str].copy()  # Return a copy to avoid modification
+    if guild_id_str in store.welcome_messages and store.welcome_messages[guild_id_str]:
+        return store.welcome_messages[guild_id_str].copy()  # Return a copy to avoid modification
     return DEFAULT_MESSAGES.copy()  # Always return a copy of defaults
 
 # -----------------------
 # Bot
 # -----------------------
+SLASH_COMMANDS = []  # added to every tenant's command tree in setup_hook
+tenants = []         # every WelcomeBot this process hosts
+
+def slash_command(**kwargs):
+    """Like bot.tree.command, but not tied to one client, so each tenant registers the same commands."""
+    def decorator(func):
+        command = app_commands.command(**kwargs)(func)
+        SLASH_COMMANDS.append(command)
+        return command
+    return decorator
+
 class WelcomeBot(commands.Bot):
-    def __init__(self):
+    def __init__(self, config: Config = None, store: TenantStore = None, name: str = "default"):
         intents = discord.Intents.default()
         intents.members = True
         intents.guilds = True
         intents.message_content = True
         # Slash-only bot: use a dummy callable prefix to prevent crashes
         super().__init__(command_prefix=lambda bot, msg: [], intents=intents, help_command=None)
-        self.config = Config()
-        self.session = None
+        self.tenant = name
+        self.config = config or Config()
+        self.store = store or TenantStore()
+        self.catchup_task = None
+        tenants.append(self)
 
     async def setup_hook(self):
-        self.session = aiohttp.ClientSession()
+        await start_shared_services()
+        for command in SLASH_COMMANDS:
+            self.tree.add_command(command)
         try:
             await self.tree.sync()
-            logger.info("Slash commands synced.")
+            logger.info("[%s] Slash commands synced.", self.tenant)
         except Exception as e:
-            logger.warning(f"Failed to auto-sync slash commands: {e}")
-        logger.info("Bot setup complete.")
+            logger.warning("[%s] Failed to auto-sync slash commands: %s", self.tenant, e)
+        logger.info("[%s] Bot setup complete.", self.tenant)
+
+    async def on_ready(self):
+        logger.info("[%s] Logged in as %s (%d guilds)", self.tenant, self.user, len(self.guilds))
+        # on_ready can fire again after a full reconnect; marks + the session set keep this idempotent
+        self.catchup_task = asyncio.create_task(catch_up_missed_joins(self))
+
+    async def on_member_join(self, member: discord.Member):
+        await welcome_member(self, member)
 
     async def close(self):
-        if self.session:
-            await self.session.close()
+        if command_tasks:
+            await asyncio.wait(list(command_tasks), timeout=5)
+        self.store.flush()
         await super().close()
 
-bot = WelcomeBot()
+# -----------------------
+# Shared services (one set per process, however many tenants it hosts)
+# -----------------------
+loop_monitor_task = None
+memory_census_task = None
+metrics_server = None
+
+async def start_shared_services():
+    """Idempotent: the first tenant's setup_hook starts everything, later tenants find it running."""
+    global loop_monitor_task, memory_census_task, metrics_server
+    await http_client.start()
+    if loop_monitor_task is None or loop_monitor_task.done():
+        loop_monitor_task = asyncio.create_task(monitor_event_loop())
+    if MEMORY_CENSUS_INTERVAL > 0 and (memory_census_task is None or memory_census_task.done()):
+        memory_census_task = asyncio.create_task(run_memory_census())
+    loop_watchdog.start()
+    if METRICS_PORT and not metrics_server:
+        metrics_server = start_metrics_server(METRICS_PORT)
+
+async def stop_shared_services():
+    global loop_monitor_task, memory_census_task
+    for task in (loop_monitor_task, memory_census_task):
+        if task:
+            task.cancel()
+    loop_monitor_task = memory_census_task = None
+    loop_watchdog.stop()
+    await http_client.close()
+    RENDER_POOL.shutdown(wait=False, cancel_futures=True)
+
+# -----------------------
+# Banner themes (per guild, compiled into cached render plans)
+# -----------------------
+BANNER_SIZE = (800, 400)
+AVATAR_SIZE = 200
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")  # what load_font / the cmap reader accept
+FALLBACK_FONT_PATHS = [
+    os.path.join(FONTS_DIR, "DejaVuSans-Bold.ttf"),  # Bundled font file
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",  # Keep as backup
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+]
+# Tried in order for characters the theme font has no glyph for (extra paths via BANNER_FALLBACK_FONTS,
+# separated by os.pathsep; any other font dropped into fonts/ is also used)
+FALLBACK_TEXT_FONTS = [p for p in os.getenv("BANNER_FALLBACK_FONTS", "").split(os.pathsep) if p] + [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSansSymbols2-Regular.ttf",
+    "/usr/share/fonts/truetype/noto/NotoEmoji-Regular.ttf",
+    "/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/unifont/unifont.ttf",
+]
+TEXT_MIN_SIZE = 16
+TEXT_RIGHT_MARGIN = 20
+
+DEFAULT_BANNER_THEME = {
+    "headline": "GREETINGS!",
+    "headline_color": "#DC143C",
+    "headline_glow": "#DC143C",
+    "name_color": "#FAFAFA",
+    "name_glow": "(200,50,200)",
+    "count_color": "#B4B4B4",
+    "count_glow": "(200,50,200)",
+    "font": "DejaVuSans-Bold.ttf",
+    "headline_size": 55,
+    "text_size": 32,
+    "avatar_x": 80,
+    "text_x": 320,
+    "headline_y": 118,
+    "name_y": 190,
+    "count_y": 240,
+    "overlay_alpha": 120,
+    "animated": False,  # animate banners for members with animated avatars (see ANIMATED_* budgets)
+}
+
+class RenderPlan(NamedTuple):
+    """Everything create_welcome_banner needs, resolved once per theme (colours parsed, fonts loaded)."""
+    headline: str
+    headline_color: tuple
+    headline_glow: tuple
+    name_color: tuple
+    name_glow: tuple
+    count_color: tuple
+    count_glow: tuple
+    font_chain: tuple  # primary font path followed by glyph fallbacks
+    headline_size: int
+    text_size: int
+    text_max_width: int
+    avatar_pos: tuple
+    text_x: int
+    headline_y: int
+    name_y: int
+    count_y: int
+    overlay: Image.Image   # shared, never mutated
+    avatar_mask: Image.Image  # shared, never mutated
+    animated: bool
+
+def color_to_rgb(value) -> tuple:
+    color = parse_color(value)
+    return ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+@lru_cache(maxsize=32)
+def load_font(name: str, size: int):
+    candidates = [name if os.path.isabs(name) else os.path.join(FONTS_DIR, name)] + FALLBACK_FONT_PATHS
+    for fp in candidates:
+        try:
+            if os.path.exists(fp):
+                return ImageFont.truetype(fp, size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+@lru_cache(maxsize=8)
+def _shared_layers(overlay_alpha: int):
+    overlay = Image.new("RGBA", BANNER_SIZE, (0, 0, 0, overlay_alpha))
+    mask = Image.new('L', (AVATAR_SIZE, AVATAR_SIZE), 0)
+    ImageDraw.Draw(mask).ellipse([0, 0, AVATAR_SIZE, AVATAR_SIZE], fill=255)
+    return overlay, mask
+
+def compile_banner_theme(theme: dict) -> RenderPlan:
+    t = {**DEFAULT_BANNER_THEME, **(theme or {})}
+    overlay, mask = _shared_layers(max(0, min(255, int(t["overlay_alpha"]))))
+    return RenderPlan(
+        headline=t["headline"],
+        headline_color=color_to_rgb(t["headline_color"]),
+        headline_glow=color_to_rgb(t["headline_glow"]),
+        name_color=color_to_rgb(t["name_color"]),
+        name_glow=color_to_rgb(t["name_glow"]),
+        count_color=color_to_rgb(t["count_color"]),
+        count_glow=color_to_rgb(t["count_glow"]),
+        font_chain=resolve_font_chain(t["font"]),
+        headline_size=int(t["headline_size"]),
+        text_size=int(t["text_size"]),
+        text_max_width=max(1, BANNER_SIZE[0] - int(t["text_x"]) - TEXT_RIGHT_MARGIN),
+        avatar_pos=(int(t["avatar_x"]), (BANNER_SIZE[1] - AVATAR_SIZE) // 2),
+        text_x=int(t["text_x"]),
+        headline_y=int(t["headline_y"]),
+        name_y=int(t["name_y"]),
+        count_y=int(t["count_y"]),
+        overlay=overlay,
+        avatar_mask=mask,
+        animated=bool(t["animated"]),
+    )
+
+@lru_cache(maxsize=256)
+def _compile_theme_json(theme_json: str) -> RenderPlan:
+    return compile_banner_theme(json.loads(theme_json))
+
+def get_render_plan(store: TenantStore, guild_id: int) -> RenderPlan:
+    plan = store.render_plans.get(guild_id)
+    if plan is None:
+        CACHE_LOOKUPS.inc(cache="render_plan", result="miss")
+        # Keyed by theme content, so tenants (and guilds) with the same theme share one compiled plan
+        theme_json = json.dumps(store.banner_themes.get(str(guild_id)) or {}, sort_keys=True)
+        plan = store.render_plans[guild_id] = _compile_theme_json(theme_json)
+    else:
+        CACHE_LOOKUPS.inc(cache="render_plan", result="hit")
+    return plan
+
+def invalidate_render_plan(store: TenantStore, guild_id: int):
+    store.render_plans.pop(guild_id, None)
 
 # -----------------------
-# Banner generator
+# Text layout: per-character font fallback + auto-fit
 # -----------------------
-def create_welcome_banner(member: discord.Member):
-    try:
-        avatar_response = requests.get(str(member.display_avatar.with_size(512).url))
-        avatar_img = Image.open(BytesIO(avatar_response.content)).convert("RGBA")
-
-        width, height = 800, 400
-        bg = avatar_img.resize((width, height), Image.Resampling.LANCZOS)
-        bg = bg.filter(ImageFilter.GaussianBlur(15))
-        overlay = Image.new("RGBA", (width, height), (0, 0, 0, 120))
-        bg.paste(overlay, (0, 0), overlay)
-
-        avatar_size = 200
-        avatar_img = avatar_img.resize((avatar_size, avatar_size), Image.Resampling.LANCZOS)
-        mask = Image.new('L', (avatar_size, avatar_size), 0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.ellipse([0, 0, avatar_size, avatar_size], fill=255)
-
-        circular_avatar = Image.new('RGBA', (avatar_size, avatar_size), (0, 0, 0, 0))
-        circular_avatar.paste(avatar_img, (0, 0))
-        circular_avatar.putalpha(mask)
-
-        avatar_x = 80
-        avatar_y = (height - avatar_size) // 2
-
-        font_paths = [
-        "fonts/DejaVuSans-Bold.ttf",  # Your local font file
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",  # Keep as backup
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-        ]
-
-        title_font = subtitle_font = None
-        for fp in font_paths:
+def read_cmap_coverage(path: str):
+    """Codepoints a TrueType/OpenType font (or the first face of a .ttc) has glyphs for, read straight from its cmap.
+
+    Returns (starts, ends): sorted, merged inclusive ranges ready for bisect.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    u16 = lambda o: struct.unpack_from(">H", data, o)[0]
+    u32 = lambda o: struct.unpack_from(">I", data, o)[0]
+    base = u32(12) if data[:4] == b"ttcf" else 0
+    cmap = None
+    for i in range(u16(base + 4)):
+        record = base + 12 + 16 * i
+        if data[record:record + 4] == b"cmap":
+            cmap = u32(record + 8)
+            break
+    if cmap is None:
+        return [], []
+    subtables = {(u16(cmap + 4 + 8 * i), u16(cmap + 6 + 8 * i)): cmap + u32(cmap + 8 + 8 * i) for i in range(u16(cmap + 2))}
+
+    ranges = []
+    for key in ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0)):
+        sub = subtables.get(key)
+        if sub is None:
+            continue
+        fmt = u16(sub)
+        if fmt == 12:
+            for g in range(u32(sub + 12)):
+                start, end, glyph = struct.unpack_from(">III", data, sub + 16 + 12 * g)
+                ranges.append((start + (glyph == 0), end))
+            break
+        if fmt == 4:
+            seg_count = u16(sub + 6) // 2
+            ends_at, starts_at = sub + 14, sub + 16 + 2 * seg_count
+            deltas_at, offsets_at = starts_at + 2 * seg_count, starts_at + 4 * seg_count
+            for i in range(seg_count):
+                start, end = u16(starts_at + 2 * i), u16(ends_at + 2 * i)
+                delta, range_offset = u16(deltas_at + 2 * i), u16(offsets_at + 2 * i)
+                if start == 0xFFFF:
+                    continue
+                for cp in range(start, end + 1):
+                    if range_offset:
+                        glyph = u16(offsets_at + 2 * i + range_offset + 2 * (cp - start))
+                        glyph = (glyph + delta) & 0xFFFF if glyph else 0
+                    else:
+                        glyph = (cp + delta) & 0xFFFF
+                    if glyph:
+                        ranges.append((cp, cp))
+            break
+
+    starts, ends = [], []
+    for start, end in sorted(ranges):
+        if start > end:
+            continue
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+# Marks, joiners and variation selectors stay with the run they modify
+_STICKY_CODEPOINTS = {0x200C, 0x200D, 0xFE0E, 0xFE0F}
+
+class FontChain:
+    """An ordered set of font files with a codepoint -> font index built from each font's cmap."""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self._coverage = []
+        for path in paths:
             try:
-                if os.path.exists(fp):
-                    title_font = ImageFont.truetype(fp, 55)
-                    subtitle_font = ImageFont.truetype(fp, 32)
+                self._coverage.append(read_cmap_coverage(path))
+            except Exception as e:
+                logger.warning("Could not read glyph coverage from %s: %s", path, e)
+                self._coverage.append(([], []))
+        self._index = {}
+
+    def font_index(self, cp: int) -> int:
+        index = self._index.get(cp)
+        if index is None:
+            index = 0  # nobody has it: let the primary font draw its .notdef
+            for i, (starts, ends) in enumerate(self._coverage):
+                j = bisect_right(starts, cp) - 1
+                if j >= 0 and cp <= ends[j]:
+                    index = i
                     break
-            except Exception:
+            self._index[cp] = index
+        return index
+
+    def split_runs(self, text: str):
+        runs = []
+        for ch in text:
+            cp = ord(ch)
+            if runs and (cp in _STICKY_CODEPOINTS or unicodedata.combining(ch)):
+                runs[-1][1] += ch
                 continue
-        if not title_font:
-            title_font = subtitle_font = ImageFont.load_default()
-
-        def draw_neon_text(banner, text, pos, font, base_color=(255,255,255), glow_color=(220,20,60)):
-            draw = ImageDraw.Draw(banner)
-            for blur_radius in [5]:
-                glow = Image.new("RGBA", banner.size, (0,0,0,0))
-                glow_draw = ImageDraw.Draw(glow)
-                glow_draw.text(pos, text, font=font, fill=glow_color + (120,))
-                glow = glow.filter(ImageFilter.GaussianBlur(blur_radius))
-                banner.alpha_composite(glow)
-                draw.text(pos, text, font=font, fill=base_color)
-
-        frame = bg.copy()
-        frame.paste(circular_avatar, (avatar_x, avatar_y), circular_avatar)
-        text_x = 320
-        draw_neon_text(frame, "GREETINGS!", (text_x, 118), title_font, base_color=(220,20,60), glow_color=(220,20,60))
-        username = member.display_name
-        if len(username) > 28:
-            username = username[:25] + "..."
-        draw_neon_text(frame, username, (text_x, 190), subtitle_font, base_color=(250,250,250), glow_color=(200,50,200))
-        member_text = f"Member #{len(member.guild.members)}"
-        draw_neon_text(frame, member_text, (text_x, 240), subtitle_font, base_color=(180,180,180), glow_color=(200,50,200))
+            index = self.font_index(cp)
+            if runs and runs[-1][0] == index:
+                runs[-1][1] += ch
+            else:
+                runs.append([index, ch])
+        return runs
+
+    def font(self, index: int, size: int):
+        return load_font(self.paths[index], size)
+
+def resolve_font_chain(primary: str) -> tuple:
+    primary_path = primary if os.path.isabs(primary) else os.path.join(FONTS_DIR, primary)
+    bundled = sorted(os.path.join(FONTS_DIR, f) for f in os.listdir(FONTS_DIR)
+                     if f.lower().endswith(FONT_EXTENSIONS)) if os.path.isdir(FONTS_DIR) else []
+    chain = []
+    for path in [primary_path] + FALLBACK_FONT_PATHS + bundled + FALLBACK_TEXT_FONTS:
+        if path not in chain and os.path.isfile(path):
+            chain.append(path)
+    return tuple(chain)
+
+@lru_cache(maxsize=16)
+def get_font_chain(paths: tuple) -> FontChain:
+    return FontChain(paths)
+
+class TextLayout(NamedTuple):
+    runs: tuple      # ((text, font, x_offset), ...)
+    width: float
+    baseline: int    # offset from the line's top to the baseline
+
+@lru_cache(maxsize=4096)
+def layout_text(text: str, chain_paths: tuple, size: int) -> TextLayout:
+    chain = get_font_chain(chain_paths)
+    runs, x = [], 0.0
+    for index, run in chain.split_runs(text):
+        font = chain.font(index, size)
+        runs.append((run, font, x))
+        x += font.getlength(run)
+    return TextLayout(tuple(runs), x, chain.font(0, size).getmetrics()[0])
+
+@lru_cache(maxsize=4096)
+def fit_text(text: str, chain_paths: tuple, max_size: int, max_width: int, min_size: int = TEXT_MIN_SIZE) -> TextLayout:
+    """Largest size (<= max_size) at which text fits max_width; below min_size it is ellipsized instead.
+
+    The baseline stays where it would be at max_size, so shrunk text sits on the same line.
+    """
+    baseline = layout_text("", chain_paths, max_size).baseline
+    size = max_size
+    layout = layout_text(text, chain_paths, size)
+    while layout.width > max_width and size > min_size:
+        # Width scales ~linearly with size, so jump straight to the estimate
+        size = max(min_size, min(size - 1, int(size * max_width / layout.width)))
+        layout = layout_text(text, chain_paths, size)
+    if layout.width > max_width:
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if layout_text(text[:mid].rstrip() + "…", chain_paths, size).width <= max_width:
+                lo = mid
+            else:
+                hi = mid - 1
+        layout = layout_text(text[:lo].rstrip() + "…", chain_paths, size)
+    return layout._replace(baseline=baseline)
+
+# -----------------------
+# Avatar acquisition: smallest CDN size / cheapest format that covers the banner
+# -----------------------
+CDN_SIZES = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+AVATAR_STATIC_FORMAT = os.getenv("AVATAR_STATIC_FORMAT", "webp")  # smallest payload that keeps transparency
+BG_BLUR_SCALE = 4  # the background is blurred at 1/4 size and upscaled; under a radius-15 blur it looks the same
+BG_SMALL_SIZE = (BANNER_SIZE[0] // BG_BLUR_SCALE, BANNER_SIZE[1] // BG_BLUR_SCALE)
+AVATAR_SOURCE_SIZE = next(size for size in CDN_SIZES if size >= max(AVATAR_SIZE, *BG_SMALL_SIZE))
+AVATAR_MAX_BYTES = 10 * 1024 * 1024  # animated GIF avatars at AVATAR_SOURCE_SIZE stay well under this
+
+def avatar_asset(member: discord.Member, animate: bool = False):
+    avatar = member.display_avatar
+    if animate:
+        return avatar.replace(size=AVATAR_SOURCE_SIZE, format="gif")
+    if "/embed/avatars/" in str(avatar.url):
+        return avatar  # default avatars are a fixed-size PNG
+    return avatar.replace(size=AVATAR_SOURCE_SIZE, format=AVATAR_STATIC_FORMAT)
+
+def decode_avatar(data: bytes) -> Image.Image:
+    """Decode once; the circle and the background both come from this image.
+
+    No reduced-resolution decode: the CDN already serves AVATAR_SOURCE_SIZE, which is under twice the target.
+    """
+    return Image.open(BytesIO(data)).convert("RGBA")
+
+AVATAR_CACHE_BYTES = int(os.getenv("AVATAR_CACHE_BYTES", str(16 * 1024 * 1024)))  # 0 disables
+
+class AvatarCache:
+    """Byte-bounded LRU of downloaded avatars, shared by every tenant in the process.
+
+    Keys are CDN URLs, which embed the avatar hash, so an entry can't go stale. Concurrent misses for the same
+    URL (one member joining guilds served by two tenants) share a single download.
+    """
+
+    def __init__(self, max_bytes: int = AVATAR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, url: str) -> bytes:
+        data = self._entries.get(url)
+        if data is not None:
+            self._entries.move_to_end(url)
+            CACHE_LOOKUPS.inc(cache="avatar", result="hit")
+            return data
+        task = self._pending.get(url)
+        if task is None:
+            CACHE_LOOKUPS.inc(cache="avatar", result="miss")
+            task = self._pending[url] = asyncio.create_task(self._fetch(url))
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        else:
+            CACHE_LOOKUPS.inc(cache="avatar", result="shared")
+        return await asyncio.shield(task)  # one caller timing out mustn't cancel the others' download
+
+    async def _fetch(self, url: str) -> bytes:
+        fetch_started = time.perf_counter()
+        response = await http_client.get(url, max_bytes=AVATAR_MAX_BYTES)
+        AVATAR_FETCH_SECONDS.observe(time.perf_counter() - fetch_started)
+        if not response.ok:
+            raise HttpError(f"avatar fetch returned HTTP {response.status}")
+        data = response.content
+        if 0 < len(data) <= self.max_bytes // 8:  # one huge GIF shouldn't flush everything else
+            self._entries[url] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return data
+
+avatar_cache = AvatarCache()
+AVATAR_CACHE_SIZE = Gauge("avatar_cache_bytes", "Bytes held by the shared avatar cache", function=lambda: avatar_cache.size)
 
-        img_buffer = BytesIO()
+# -----------------------
+# Banner generator
+# -----------------------
+def draw_neon_text(banner, layout: TextLayout, pos, base_color=(255,255,255), glow_color=(220,20,60)):
+    x, y = pos
+    baseline = y + layout.baseline
+    glow = Image.new("RGBA", banner.size, (0,0,0,0))
+    glow_draw = ImageDraw.Draw(glow)
+    for run, font, dx in layout.runs:
+        glow_draw.text((x + dx, baseline), run, font=font, fill=glow_color + (120,), anchor="ls")
+    banner.alpha_composite(glow.filter(ImageFilter.GaussianBlur(5)))
+    draw = ImageDraw.Draw(banner)
+    for run, font, dx in layout.runs:
+        draw.text((x + dx, baseline), run, font=font, fill=base_color, anchor="ls")
+
+def compose_banner(plan: RenderPlan, avatar_img: Image.Image, username: str, member_text: str, draw_avatar: bool = True):
+    """Render one RGBA banner frame. avatar_img is the RGBA source for the background (and the circle if draw_avatar)."""
+    bg = avatar_img.resize(BG_SMALL_SIZE, Image.Resampling.BILINEAR)
+    bg = bg.filter(ImageFilter.GaussianBlur(15 / BG_BLUR_SCALE))
+    bg = bg.resize(BANNER_SIZE, Image.Resampling.BILINEAR)
+    bg.paste(plan.overlay, (0, 0), plan.overlay)
+
+    frame = bg
+    if draw_avatar:
+        circular_avatar = circle_avatar(plan, avatar_img)
+        frame.paste(circular_avatar, plan.avatar_pos, circular_avatar)
+    draw_neon_text(frame, fit_text(plan.headline, plan.font_chain, plan.headline_size, plan.text_max_width),
+                   (plan.text_x, plan.headline_y), base_color=plan.headline_color, glow_color=plan.headline_glow)
+    draw_neon_text(frame, fit_text(username, plan.font_chain, plan.text_size, plan.text_max_width),
+                   (plan.text_x, plan.name_y), base_color=plan.name_color, glow_color=plan.name_glow)
+    draw_neon_text(frame, fit_text(member_text, plan.font_chain, plan.text_size, plan.text_max_width),
+                   (plan.text_x, plan.count_y), base_color=plan.count_color, glow_color=plan.count_glow)
+    return frame
+
+def circle_avatar(plan: RenderPlan, avatar_img: Image.Image):
+    avatar_img = avatar_img.resize((AVATAR_SIZE, AVATAR_SIZE), Image.Resampling.LANCZOS)
+    circular_avatar = Image.new('RGBA', (AVATAR_SIZE, AVATAR_SIZE), (0, 0, 0, 0))
+    circular_avatar.paste(avatar_img, (0, 0))
+    circular_avatar.putalpha(plan.avatar_mask)
+    return circular_avatar
+
+# -----------------------
+# Animated banners (budgeted; fall back to the static PNG)
+# -----------------------
+ANIMATED_MAX_FRAMES = int(os.getenv("ANIMATED_MAX_FRAMES", "24"))
+ANIMATED_MIN_FRAME_MS = int(os.getenv("ANIMATED_MIN_FRAME_MS", "80"))  # decimate faster animations down to this
+ANIMATED_MAX_SOURCE_FRAMES = int(os.getenv("ANIMATED_MAX_SOURCE_FRAMES", "300"))
+ANIMATED_MAX_RENDER_MS = int(os.getenv("ANIMATED_MAX_RENDER_MS", "1500"))
+ANIMATED_MAX_BYTES = int(os.getenv("ANIMATED_MAX_BYTES", str(4 * 1024 * 1024)))
+PALETTE_SAMPLE_FRAMES = 4
+
+class AnimationBudgetExceeded(Exception):
+    pass
+
+def select_animation_frames(durations, min_frame_ms: int = ANIMATED_MIN_FRAME_MS, max_frames: int = ANIMATED_MAX_FRAMES):
+    """Decimate a frame timeline. Returns [(source_index, duration_ms)], folding dropped frames' time into the kept ones."""
+    kept = []
+    for index, duration in enumerate(durations):
+        if kept and kept[-1][1] < min_frame_ms:
+            kept[-1][1] += duration
+        else:
+            kept.append([index, duration])
+    if len(kept) > max_frames:
+        stride = -(-len(kept) // max_frames)
+        merged = []
+        for i in range(0, len(kept), stride):
+            group = kept[i:i + stride]
+            merged.append([group[0][0], sum(d for _, d in group)])
+        kept = merged
+    return [(index, duration) for index, duration in kept]
+
+def render_animated_banner(plan: RenderPlan, avatar_img: Image.Image, username: str, member_text: str):
+    """Render an animated GIF banner within the ANIMATED_* budgets.
+
+    Static layers (blurred background, overlay, text) are composited once; each frame only pastes the avatar
+    circle, and every frame is mapped onto one palette quantized once for the whole animation.
+    Returns a BytesIO, or None if the avatar isn't animated or a budget would be exceeded.
+    """
+    deadline = time.perf_counter() + ANIMATED_MAX_RENDER_MS / 1000
+
+    def check_deadline(stage: str):
+        if time.perf_counter() > deadline:
+            raise AnimationBudgetExceeded(stage)
+
+    source_frames = getattr(avatar_img, "n_frames", 1)
+    if source_frames < 2:
+        return None
+    if source_frames > ANIMATED_MAX_SOURCE_FRAMES:
+        raise AnimationBudgetExceeded(f"{source_frames} source frames")
+
+    durations = []
+    for i in range(source_frames):
+        avatar_img.seek(i)  # seeking decodes every frame up to i, so a long GIF can spend the budget here
+        durations.append(avatar_img.info.get("duration") or 100)
+        check_deadline("seek")
+    picks = select_animation_frames(durations)
+
+    circles = []
+    for index, _ in picks:
+        avatar_img.seek(index)
+        circles.append(circle_avatar(plan, avatar_img.convert("RGBA")))
+        check_deadline("decode")
+
+    avatar_img.seek(0)
+    static = compose_banner(plan, avatar_img.convert("RGBA"), username, member_text, draw_avatar=False)
+
+    # One shared palette: the static layers plus a few sampled avatar frames
+    sample_step = max(1, len(circles) // PALETTE_SAMPLE_FRAMES)
+    samples = circles[::sample_step][:PALETTE_SAMPLE_FRAMES]
+    mosaic = Image.new("RGBA", (BANNER_SIZE[0], BANNER_SIZE[1] + AVATAR_SIZE), (0, 0, 0, 255))
+    mosaic.paste(static, (0, 0))
+    for i, circle in enumerate(samples):
+        mosaic.paste(circle, (i * AVATAR_SIZE, BANNER_SIZE[1]), circle)
+    palette = mosaic.convert("RGB").quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+    check_deadline("palette")
+
+    frames = []
+    for circle in circles:
+        frame = static.copy()
+        frame.paste(circle, plan.avatar_pos, circle)
+        frames.append(frame.convert("RGB").quantize(palette=palette, dither=Image.Dither.NONE))
+        check_deadline("compose")
+
+    # The GIF encode can't be interrupted and is the slowest step, so only start it with budget left
+    check_deadline("encode")
+    encode_started = time.perf_counter()
+    img_buffer = BytesIO()
+    frames[0].save(img_buffer, format="GIF", save_all=True, append_images=frames[1:],
+                   duration=[d for _, d in picks], loop=0)
+    BANNER_ENCODE_SECONDS.observe(time.perf_counter() - encode_started, kind="gif")
+    if img_buffer.tell() > ANIMATED_MAX_BYTES:
+        raise AnimationBudgetExceeded(f"{img_buffer.tell()} bytes")
+    img_buffer.seek(0)
+    return img_buffer
+
+def banner_filename(banner_buffer) -> str:
+    return "welcome_banner.gif" if banner_buffer.getvalue()[:4] == b"GIF8" else "welcome_banner.png"
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_POOL = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="banner-render")
+RENDER_JOBS = Gauge("banner_render_jobs", "RENDER_POOL jobs waiting for a worker (queued) or running (active)", ["state"])
+RENDER_JOBS.set(0, state="queued")
+RENDER_JOBS.set(0, state="active")
+
+def _run_render_job(func, args):
+    RENDER_JOBS.dec(state="queued")
+    RENDER_JOBS.inc(state="active")
+    try:
+        return func(*args)
+    finally:
+        RENDER_JOBS.dec(state="active")
+
+async def run_in_render_pool(func, *args):
+    """run_in_executor on RENDER_POOL, keeping the queued / active gauges in step with the pool's backlog."""
+    RENDER_JOBS.inc(state="queued")
+    future = RENDER_POOL.submit(_run_render_job, func, args)
+    # A job cancelled before it started (shutdown, caller gone) never reaches _run_render_job
+    future.add_done_callback(lambda f: RENDER_JOBS.dec(state="queued") if f.cancelled() else None)
+    return await asyncio.wrap_future(future)
+
+def render_welcome_banner(plan: RenderPlan, avatar_bytes: bytes, animate: bool, username: str, member_text: str,
+                          trace=NULL_TRACE):
+    """Turn downloaded avatar bytes into an encoded banner (GIF when animated and within budget, else PNG).
+
+    Pure CPU work with no Discord or network access, so it runs on RENDER_POOL (Pillow releases the GIL for
+    most of it) and can be reused offline.
+    """
+    if animate:
+        avatar_img = Image.open(BytesIO(avatar_bytes))
+        try:
+            render_started = time.perf_counter()
+            with trace.span("render_animated"):
+                animated_buffer = render_animated_banner(plan, avatar_img, username, member_text)
+            if animated_buffer:
+                BANNER_RENDER_SECONDS.observe(time.perf_counter() - render_started, kind="gif")
+                return animated_buffer
+        except AnimationBudgetExceeded as e:
+            logger.info("Animated banner over budget (%s), using static banner", e)
+        except Exception as e:
+            logger.warning("Animated banner failed (%s), using static banner", e)
+
+    render_started = time.perf_counter()
+    with trace.span("render"):
+        frame = compose_banner(plan, decode_avatar(avatar_bytes), username, member_text)
+    encode_started = time.perf_counter()
+    BANNER_RENDER_SECONDS.observe(encode_started - render_started, kind="png")
+    img_buffer = BytesIO()
+    with trace.span("encode"):
         frame.save(img_buffer, format="PNG")
-        img_buffer.seek(0)
-        return img_buffer
+    BANNER_ENCODE_SECONDS.observe(time.perf_counter() - encode_started, kind="png")
+    img_buffer.seek(0)
+    return img_buffer
+
+async def create_welcome_banner(store: TenantStore, member: discord.Member, trace=NULL_TRACE):
+    try:
+        plan = get_render_plan(store, member.guild.id)
+        animate = plan.animated and member.display_avatar.is_animated()
+        asset = avatar_asset(member, animate)
+        with trace.span("avatar_fetch", animated=animate) as span:
+            avatar_bytes = await avatar_cache.get(str(asset.url))
+            span["bytes"] = len(avatar_bytes)
+        username = member.display_name
+        member_text = f"Member #{len(member.guild.members)}"
+        return await run_in_render_pool(render_welcome_banner, plan, avatar_bytes, animate, username, member_text, trace)
     except Exception as e:
-        logger.error(f"Error creating welcome banner: {e}")
+        logger.error("Error creating welcome banner: %s", e)
         return None
+
+# -----------------------
+# Webhook welcome delivery
+# -----------------------
+WEBHOOK_URL_RE = re.compile(r"^https://(?:(?:canary|ptb)\.)?discord(?:app)?\.com/api/(?:v\d+/)?webhooks/(\d+)/([\w-]+)/?$")
+WEBHOOK_MAX_WAIT = float(os.getenv("WEBHOOK_MAX_WAIT", "2.0"))  # seconds we'll wait on a webhook bucket before falling back
+
+def get_welcome_webhook_url(client: "WelcomeBot", guild_id: int):
+    url = client.store.welcome_webhooks.get(str(guild_id))
+    if url:
+        return url
+    if client.config.webhook_url and client.config.guild_id and str(guild_id) == client.config.guild_id:
+        return client.config.webhook_url
+    return None
+
+class WebhookRateLimiter:
+    """Tracks Discord rate-limit buckets per webhook, separately from the bot's own REST buckets."""
+
+    def __init__(self):
+        self.buckets = {}   # webhook_id -> {"bucket": str, "remaining": int, "reset_at": monotonic seconds}
+        self.revoked = set()  # full webhook URLs that returned 401/404
+
+    def wait_time(self, webhook_id: str) -> float:
+        state = self.buckets.get(webhook_id)
+        if not state or state["remaining"] > 0:
+            return 0.0
+        return max(0.0, state["reset_at"] - time.monotonic())
+
+    def update(self, webhook_id: str, headers, retry_after: float = None):
+        now = time.monotonic()
+        state = self.buckets.setdefault(webhook_id, {"bucket": None, "remaining": 1, "reset_at": now})
+        state["bucket"] = headers.get("X-RateLimit-Bucket", state["bucket"])
+        if retry_after is not None:
+            state["remaining"] = 0
+            state["reset_at"] = now + retry_after
+            return
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            state["remaining"] = int(remaining)
+        if reset_after is not None:
+            state["reset_at"] = now + float(reset_after)
+        elif state["reset_at"] <= now:
+            state["remaining"] = max(state["remaining"], 1)
+
+webhook_limiter = WebhookRateLimiter()
+
+def webhook_retry_after(resp: HttpResponse) -> float:
+    """Back-off after a webhook 429. Discord sends it in the JSON body, but an edge ban answers with HTML,
+    so fall back to the rate-limit headers."""
+    try:
+        return float((resp.json() or {})["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    for header in ("Retry-After", "X-RateLimit-Reset-After"):
+        try:
+            return float(resp.headers[header])
+        except (KeyError, ValueError):
+            continue
+    return 1.0
+
+async def send_via_webhook(client: "WelcomeBot", url: str, content: str, embed: discord.Embed, banner_buffer=None, mention_ids=()):
+    """Execute a webhook through the shared http_client (no retries: the fallback is channel.send).
+
+    Returns True when Discord accepted the message, False when the caller should fall back
+    to channel.send (revoked webhook, rate limited beyond WEBHOOK_MAX_WAIT, errors of any kind).
+    """
+    try:
+        return await _send_via_webhook(client, url, content, embed, banner_buffer, mention_ids)
+    except Exception:
+        logger.exception("Webhook delivery failed, falling back to channel.send")
+        return False
+
+async def _send_via_webhook(client: "WelcomeBot", url: str, content: str, embed: discord.Embed, banner_buffer, mention_ids):
+    match = WEBHOOK_URL_RE.match(url)
+    if not match or url in webhook_limiter.revoked:
+        return False
+    webhook_id = match.group(1)
+
+    wait = webhook_limiter.wait_time(webhook_id)
+    if wait > WEBHOOK_MAX_WAIT:
+        logger.info("Webhook %s rate limited for %.1fs, falling back to channel.send", webhook_id, wait)
+        return False
+    if wait:
+        await asyncio.sleep(wait)
+
+    payload = {
+        "content": content,
+        "embeds": [embed.to_dict()],
+        "allowed_mentions": {"parse": [], "users": [str(i) for i in mention_ids]},
+    }
+    if client.user:
+        payload["username"] = client.user.display_name
+        payload["avatar_url"] = str(client.user.display_avatar.url)
+    form = aiohttp.FormData()
+    if banner_buffer:
+        filename = banner_filename(banner_buffer)
+        payload["attachments"] = [{"id": 0, "filename": filename}]
+        form.add_field("files[0]", banner_buffer.getvalue(), filename=filename,
+                       content_type="image/gif" if filename.endswith(".gif") else "image/png")
+    form.add_field("payload_json", json.dumps(payload), content_type="application/json")
+
+    try:
+        resp = await http_client.request("POST", url.rstrip("/"), params={"wait": "true"}, data=form, retries=0)
+    except HttpError as e:
+        logger.warning("Webhook %s request failed: %s", webhook_id, e)
+        return False
+    if resp.status == 429:
+        retry_after = webhook_retry_after(resp)
+        webhook_limiter.update(webhook_id, resp.headers, retry_after=retry_after)
+        RATE_LIMIT_HITS.inc(source="webhook")
+        logger.warning("Webhook %s hit 429 (retry after %ss), falling back", webhook_id, retry_after)
+        return False
+    webhook_limiter.update(webhook_id, resp.headers)
+    if resp.status in (401, 404):
+        webhook_limiter.revoked.add(url)
+        logger.warning("Webhook %s is missing or revoked (HTTP %d), falling back to channel.send", webhook_id, resp.status)
+        return False
+    if resp.status >= 300:
+        logger.warning("Webhook %s returned HTTP %d: %.200s", webhook_id, resp.status, resp.text())
+        return False
+    return True
+
+async def deliver_welcome(client: "WelcomeBot", member: discord.Member, channel, embed: discord.Embed, banner_buffer=None, trace=NULL_TRACE):
+    """Send a welcome through the guild's webhook if one is configured, otherwise (or on failure) via channel.send."""
+    filename = banner_filename(banner_buffer) if banner_buffer else None
+    if banner_buffer:
+        embed.set_image(url=f"attachment://{filename}")
+    webhook_url = get_welcome_webhook_url(client, member.guild.id)
+    if webhook_url:
+        with trace.span("webhook_send") as span:
+            span["ok"] = await send_via_webhook(client, webhook_url, member.mention, embed, banner_buffer, mention_ids=(member.id,))
+        if span["ok"]:
+            return "webhook"
+    with trace.span("channel_send"):
+        if banner_buffer:
+            banner_buffer.seek(0)
+            file = File(banner_buffer, filename=filename)
+            await channel.send(content=member.mention, embed=embed, file=file)
+        else:
+            await channel.send(content=member.mention, embed=embed)
+    return "channel"
+
+# -----------------------
+# Duplicate-join suppression (gateway resumes / reconnects can replay GUILD_MEMBER_ADD)
+# -----------------------
+JOIN_DEDUPE_TTL = float(os.getenv("JOIN_DEDUPE_TTL", "900"))  # seconds a (guild, member, joined_at) claim is held
+JOIN_DEDUPE_PERSIST = os.getenv("JOIN_DEDUPE_PERSIST", "1") == "1"  # keep claims across quick restarts
+DUPLICATE_JOINS = Counter("welcome_duplicate_joins_suppressed_total", "Join events dropped as duplicates", ["guild", "source"])
+
+class JoinDedupe:
+    """Time-bounded set of welcomes already started, keyed by (guild, member, joined_at).
+
+    joined_at is part of the key so a member who leaves and rejoins is welcomed again. Every claim lives
+    for the same TTL, so insertion order is expiry order and pruning only ever pops from the front.
+    """
+
+    def __init__(self, stored: dict = None, ttl: float = JOIN_DEDUPE_TTL, on_change=None):
+        self.ttl = ttl
+        self.on_change = on_change  # called after every claim / release, e.g. to schedule a save
+        self.entries = {}  # key -> wall-clock expiry (wall clock so persisted claims survive a restart)
+        now = time.time()
+        for key, expires in sorted((stored or {}).items(), key=lambda item: item[1]):
+            if expires > now:
+                self.entries[key] = expires
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(member: discord.Member) -> str:
+        joined = int(member.joined_at.timestamp() * 1000) if member.joined_at else 0
+        return f"{member.guild.id}:{member.id}:{joined}"
+
+    def _prune(self, now: float):
+        while self.entries:
+            oldest = next(iter(self.entries))
+            if self.entries[oldest] > now:
+                break
+            del self.entries[oldest]
+
+    def claim(self, member: discord.Member, source: str = "gateway") -> bool:
+        """True if this join hasn't been seen within the TTL (and record it); False for a duplicate."""
+        now = time.time()
+        self._prune(now)
+        key = self.key(member)
+        if key in self.entries:
+            DUPLICATE_JOINS.inc(guild=member.guild.id, source=source)
+            return False
+        self.entries[key] = now + self.ttl
+        self._changed()
+        return True
+
+    def release(self, member: discord.Member):
+        """Forget a claim whose welcome failed, so a later replay or catch-up can try again."""
+        if self.entries.pop(self.key(member), None) is not None:
+            self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+JOIN_DEDUPE_SIZE = Gauge("welcome_join_dedupe_entries", "Live (guild, member, joined_at) claims",
+                         function=lambda: sum(len(client.store.join_dedupe) for client in tenants))
+
 # -----------------------
 # Welcome event
 # -----------------------
-@bot.event
-async def on_member_join(member: discord.Member):
-    logger.info(f"on_member_join fired for {member.display_name} in {member.guild.name}")
+async def welcome_member(client: "WelcomeBot", member: discord.Member):
+    """The on_member_join handler (WelcomeBot.on_member_join delegates here)."""
+    logger.info("on_member_join fired for %s in %s", member.display_name, member.guild.name)
     try:
         channel_id = get_welcome_channel_id(member.guild.id)
         if not channel_id:
-            logger.warning(f"No configured welcome channel for guild {member.guild.id}. Add it to WELCOME_CHANNELS in code.")
+            logger.warning("No configured welcome channel for guild %s. Add it to WELCOME_CHANNELS in code.", member.guild.id)
             return
         channel = member.guild.get_channel(channel_id)
         if not channel:
-            logger.warning(f"Configured welcome channel ID {channel_id} not found in guild.")
+            logger.warning("Configured welcome channel ID %s not found in guild.", channel_id)
             return
 
-        msgs = get_guild_messages(member.guild.id)
-        template = random.choice(msgs)
-        content_mention = template.format(mention=member.mention, username=member.name, server=member.guild.name)
-
-        embed = discord.Embed(
-            title="👋 Welcome to the server!",
-            description=content_mention,
-            color=0xDC143C,
-            timestamp=datetime.utcnow()
-        )
-        embed.set_footer(text=f"Joined {datetime.utcnow().strftime('%B %d, %Y')}",
-                         icon_url=str(member.guild.icon.url) if member.guild.icon else None)
+        join_dedupe = client.store.join_dedupe
+        if not join_dedupe.claim(member):
+            logger.info("Ignoring duplicate join event for %s in %s", member.id, member.guild.name)
+            return
 
-        banner_buffer = create_welcome_banner(member)
-        if banner_buffer:
-            banner_buffer.seek(0)
-            file = File(banner_buffer, filename="welcome_banner.png")
-            embed.set_image(url="attachment://welcome_banner.png")
-            await channel.send(content=member.mention, embed=embed, file=file)
-        else:
-            await channel.send(content=member.mention, embed=embed)
+        trace = JoinTrace("on_member_join", guild=member.guild.id, member=member.id)
+        WELCOMES_IN_FLIGHT.inc()
+        try:
+            via = await send_member_welcome(client, member, channel, trace)
+        except Exception:
+            join_dedupe.release(member)
+            hold_join_mark(client.store, member)
+            trace.finish("error")
+            raise
+        finally:
+            WELCOMES_IN_FLIGHT.dec()
+        WELCOMES_TOTAL.inc(guild=member.guild.id, status="sent", via=via)
+        mark_welcomed(client.store, member)
+        if member.joined_at:
+            join_to_post = (discord.utils.utcnow() - member.joined_at).total_seconds()
+            JOIN_TO_POST_SECONDS.observe(join_to_post)
+            trace.attrs["join_to_post_ms"] = round(join_to_post * 1000)
+        trace.finish()
 
     except Exception as e:
-        logger.error(f"Error in on_member_join: {e}")
+        WELCOMES_TOTAL.inc(guild=member.guild.id, status="failed", via="")
+        logger.error("Error in on_member_join: %s", e)
+
+async def send_member_welcome(client: "WelcomeBot", member: discord.Member, channel, trace=NULL_TRACE):
+    msgs = get_guild_messages(client.store, member.guild.id)
+    template = random.choice(msgs)
+    content_mention = template.format(mention=member.mention, username=member.name, server=member.guild.name)
+
+    embed = discord.Embed(
+        title="👋 Welcome to the server!",
+        description=content_mention,
+        color=0xDC143C,
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text=f"Joined {datetime.utcnow().strftime('%B %d, %Y')}",
+                     icon_url=str(member.guild.icon.url) if member.guild.icon else None)
+
+    with trace.span("banner"):
+        banner_buffer = await create_welcome_banner(client.store, member, trace)
+    return await deliver_welcome(client, member, channel, embed, banner_buffer, trace)
+
+# -----------------------
+# Missed-join catch-up (after restarts / reconnects)
+# -----------------------
+CATCHUP_DIGEST_THRESHOLD = int(os.getenv("CATCHUP_DIGEST_THRESHOLD", "5"))  # more missed joins than this -> one digest
+CATCHUP_SEND_INTERVAL = float(os.getenv("CATCHUP_SEND_INTERVAL", "1.5"))    # seconds between individual catch-up welcomes
+CATCHUP_MAX_AGE_HOURS = float(os.getenv("CATCHUP_MAX_AGE_HOURS", "24"))     # older missed joins are not welcomed
+def get_join_mark(store: TenantStore, guild_id: int):
+    value = store.join_marks.get(str(guild_id))
+    return datetime.fromisoformat(value) if value else None
+
+def mark_welcomed(store: TenantStore, member: discord.Member):
+    """Record a welcome and advance the guild's high-water mark to the member's join time.
+
+    The mark never passes a failed welcome (live or catch-up), so the next catch-up retries it. Saves are batched.
+    """
+    store.welcomed_this_session.setdefault(member.guild.id, set()).add(member.id)
+    if not member.joined_at:
+        return
+    held = store.retry_from.get(member.guild.id)
+    if held is not None and member.joined_at >= held:
+        return
+    current = get_join_mark(store, member.guild.id)
+    if current is None or member.joined_at > current:
+        store.join_marks[str(member.guild.id)] = member.joined_at.isoformat()
+        store.save_later("join_marks")
+
+def hold_join_mark(store: TenantStore, member: discord.Member):
+    """A welcome failed: keep the guild's mark below this member until a catch-up retries them."""
+    if not member.joined_at:
+        return
+    held = store.retry_from.get(member.guild.id)
+    if held is None or member.joined_at < held:
+        store.retry_from[member.guild.id] = member.joined_at
+
+def find_missed_joins(store: TenantStore, guild: discord.Guild):
+    """Members who joined after the stored mark and haven't been welcomed in this session, oldest first."""
+    mark = get_join_mark(store, guild.id)
+    if mark is None:
+        return None
+    seen = store.welcomed_this_session.get(guild.id, set())
+    missed = [m for m in guild.members if m.joined_at and m.joined_at > mark and m.id not in seen and m != guild.me]
+    return sorted(missed, key=lambda m: m.joined_at)
+
+async def send_catchup_digest(guild: discord.Guild, channel, members):
+    embed = discord.Embed(
+        title="👋 Welcome to everyone who joined while I was away!",
+        description=f"{len(members)} new members joined — great to have you all here!",
+        color=0xDC143C,
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text=guild.name, icon_url=str(guild.icon.url) if guild.icon else None)
+    chunks, current = [], ""
+    for member in members:
+        if len(current) + len(member.mention) + 1 > 2000:
+            chunks.append(current)
+            current = ""
+        current += member.mention + " "
+    chunks.append(current)
+    for i, chunk in enumerate(chunks):
+        await channel.send(content=chunk.strip(), embed=embed if i == 0 else None,
+                           allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False))
+        if i + 1 < len(chunks):
+            await asyncio.sleep(CATCHUP_SEND_INTERVAL)
+
+async def catch_up_guild(client: "WelcomeBot", guild: discord.Guild):
+    store = client.store
+    channel_id = get_welcome_channel_id(guild.id)
+    channel = guild.get_channel(channel_id) if channel_id else None
+    if not channel:
+        return 0
+    missed = find_missed_joins(store, guild)
+    if missed is None:
+        # First run for this guild: start tracking from now instead of welcoming the whole member list
+        store.join_marks[str(guild.id)] = discord.utils.utcnow().isoformat()
+        store.save_later("join_marks")
+        return 0
+    cutoff = discord.utils.utcnow().timestamp() - CATCHUP_MAX_AGE_HOURS * 3600
+    stale = [m for m in missed if m.joined_at.timestamp() < cutoff]
+    missed = [m for m in missed if m.joined_at.timestamp() >= cutoff]
+    store.retry_from.pop(guild.id, None)  # this run retries earlier failures
+    for member in stale:
+        mark_welcomed(store, member)
+    if not missed:
+        return 0
+
+    logger.info("Catching up %d missed join(s) in %s (skipped %d older than %sh)", len(missed), guild.name, len(stale), CATCHUP_MAX_AGE_HOURS)
+    if len(missed) > CATCHUP_DIGEST_THRESHOLD:
+        missed = [m for m in missed if store.join_dedupe.claim(m, source="catchup")]
+        if not missed:
+            return 0
+        try:
+            await send_catchup_digest(guild, channel, missed)
+        except Exception:
+            # Nothing is marked, so the next catch-up (or a replayed join) can try these members again
+            for member in missed:
+                store.join_dedupe.release(member)
+            hold_join_mark(store, missed[0])  # oldest first, so this is the earliest
+            WELCOMES_TOTAL.inc(len(missed), guild=guild.id, status="failed", via="digest")
+            raise
+        for member in missed:
+            mark_welcomed(store, member)
+        WELCOMES_TOTAL.inc(len(missed), guild=guild.id, status="sent", via="digest")
+        return len(missed)
+
+    sent = 0
+    for member in missed:
+        if member.id in store.welcomed_this_session.get(guild.id, set()):
+            continue  # welcomed by a live on_member_join while we were catching up
+        if not store.join_dedupe.claim(member, source="catchup"):
+            continue  # a live (or replayed) join event already has this one in hand
+        try:
+            via = await send_member_welcome(client, member, channel)
+            WELCOMES_TOTAL.inc(guild=guild.id, status="sent", via=via)
+            mark_welcomed(store, member)
+            sent += 1
+        except Exception as e:
+            store.join_dedupe.release(member)
+            hold_join_mark(store, member)
+            WELCOMES_TOTAL.inc(guild=guild.id, status="failed", via="catchup")
+            logger.error("Catch-up welcome for %s failed: %s", member.id, e)
+        await asyncio.sleep(CATCHUP_SEND_INTERVAL)
+    return sent
+
+async def catch_up_missed_joins(client: "WelcomeBot"):
+    if client.store.catchup_lock.locked():
+        return
+    async with client.store.catchup_lock:
+        for guild in client.guilds:
+            try:
+                await catch_up_guild(client, guild)
+            except Exception as e:
+                logger.error("Missed-join catch-up failed for guild %s: %s", guild.id, e)
 
 # -----------------------
 # Slash commands: welcome message management
 # -----------------------
-@bot.tree.command(name="add_welcome", description="Add a welcome message (admin only). Use {mention}, {username}, {server}")
+@slash_command(name="add_welcome", description="Add a welcome message (admin only). Use {mention}, {username}, {server}")
 @app_commands.checks.has_permissions(administrator=True)
 async def add_welcome(interaction: discord.Interaction, message: str):
+    store = interaction.client.store
     guild_id = str(interaction.guild.id)
     # Get current messages or create empty list if none exist
-    current_messages = welcome_messages.get(guild_id, [])
+    current_messages = store.welcome_messages.get(guild_id, [])
     current_messages.append(message)
-    welcome_messages[guild_id] = current_messages
-    save_json(WELCOME_FILE, welcome_messages)
+    store.welcome_messages[guild_id] = current_messages
+    store.save("welcome_messages")
     await interaction.response.send_message("✅ Welcome message added.", ephemeral=True)
 
-@bot.tree.command(name="list_welcome", description="List welcome messages for this server")
+@slash_command(name="list_welcome", description="List welcome messages for this server")
 @app_commands.checks.has_permissions(administrator=True)
 async def list_welcome(interaction: discord.Interaction):
+    store = interaction.client.store
     guild_id = str(interaction.guild.id)
-    msgs = welcome_messages.get(guild_id, get_guild_messages(interaction.guild.id))
+    msgs = store.welcome_messages.get(guild_id, get_guild_messages(store, interaction.guild.id))
     if not msgs:
         await interaction.response.send_message("No welcome messages set.", ephemeral=True)
         return
     text = "\n".join([f"{i+1}. {m}" for i,m in enumerate(msgs)])
     await interaction.response.send_message(f"📜 Welcome messages:\n{text}", ephemeral=True)
 
-@bot.tree.command(name="remove_welcome", description="Remove a welcome message by index (admin only)")
+@slash_command(name="remove_welcome", description="Remove a welcome message by index (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 async def remove_welcome(interaction: discord.Interaction, index: int):
+    store = interaction.client.store
     guild_id = str(interaction.guild.id)
-    msgs = welcome_messages.get(guild_id, get_guild_messages(interaction.guild.id))
+    msgs = store.welcome_messages.get(guild_id, get_guild_messages(store, interaction.guild.id))
     if index < 1 or index > len(msgs):
         await interaction.response.send_message("❌ Invalid index.", ephemeral=True)
         return
     removed = msgs.pop(index-1)
-    welcome_messages[guild_id] = msgs
-    save_json(WELCOME_FILE, welcome_messages)
+    store.welcome_messages[guild_id] = msgs
+    store.save("welcome_messages")
     await interaction.response.send_message(f"Removed: `{removed}`", ephemeral=True)
 
-@bot.tree.command(name="edit_welcome", description="Edit a welcome message by index (admin only)")
+@slash_command(name="edit_welcome", description="Edit a welcome message by index (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 async def edit_welcome(interaction: discord.Interaction, index: int, new_text: str):
+    store = interaction.client.store
     guild_id = str(interaction.guild.id)
-    msgs = welcome_messages.get(guild_id, get_guild_messages(interaction.guild.id))
+    msgs = store.welcome_messages.get(guild_id, get_guild_messages(store, interaction.guild.id))
     if index < 1 or index > len(msgs):
         await interaction.response.send_message("❌ Invalid index.", ephemeral=True)
         return
     old = msgs[index-1]
     msgs[index-1] = new_text
-    welcome_messages[guild_id] = msgs
-    save_json(WELCOME_FILE, welcome_messages)
+    store.welcome_messages[guild_id] = msgs
+    store.save("welcome_messages")
     await interaction.response.send_message(f"✅ Edited message {index}.\nBefore: `{old}`\nAfter: `{new_text}`", ephemeral=True)
 
+@slash_command(name="set_welcome_webhook", description="Deliver welcomes through a webhook in the welcome channel (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(url="Webhook URL from Channel Settings → Integrations (use 'clear' to go back to normal sends)")
+async def set_welcome_webhook(interaction: discord.Interaction, url: str):
+    store = interaction.client.store
+    guild_id = str(interaction.guild.id)
+    if url == "clear":
+        store.welcome_webhooks.pop(guild_id, None)
+        store.save("welcome_webhooks")
+        await interaction.response.send_message("✅ Welcome webhook cleared; welcomes use normal channel sends.", ephemeral=True)
+        return
+    if not WEBHOOK_URL_RE.match(url):
+        await interaction.response.send_message("❌ That doesn't look like a Discord webhook URL.", ephemeral=True)
+        return
+    store.welcome_webhooks[guild_id] = url
+    webhook_limiter.revoked.discard(url)
+    store.save("welcome_webhooks")
+    await interaction.response.send_message("✅ Welcome webhook set. Try it with `/test_welcome`.", ephemeral=True)
+
+@slash_command(name="banner_theme", description="Customise this server's welcome banner; run with no options to show it (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    headline="Headline text (default GREETINGS!)",
+    headline_color="Headline colour (hex, name or (r,g,b))",
+    headline_glow="Headline glow colour",
+    name_color="Member name colour",
+    name_glow="Member name glow colour",
+    count_color="Member count colour",
+    count_glow="Member count glow colour",
+    font="Font file name from the bot's fonts/ folder",
+    headline_size="Headline font size",
+    text_size="Name / member count font size",
+    avatar_x="Avatar left offset in pixels",
+    text_x="Text left offset in pixels",
+    headline_y="Headline top offset in pixels",
+    name_y="Member name top offset in pixels",
+    count_y="Member count top offset in pixels",
+    overlay_alpha="Darkening overlay opacity (0-255)",
+    animated="Animate banners for members with animated avatars (GIF, falls back to static)"
+)
+async def banner_theme(interaction: discord.Interaction,
+                       headline: app_commands.Range[str, 1, 40] = None,
+                       headline_color: str = None, headline_glow: str = None,
+                       name_color: str = None, name_glow: str = None,
+                       count_color: str = None, count_glow: str = None,
+                       font: str = None,
+                       headline_size: app_commands.Range[int, 8, 120] = None,
+                       text_size: app_commands.Range[int, 8, 80] = None,
+                       avatar_x: app_commands.Range[int, 0, 600] = None,
+                       text_x: app_commands.Range[int, 0, 760] = None,
+                       headline_y: app_commands.Range[int, 0, 380] = None,
+                       name_y: app_commands.Range[int, 0, 380] = None,
+                       count_y: app_commands.Range[int, 0, 380] = None,
+                       overlay_alpha: app_commands.Range[int, 0, 255] = None,
+                       animated: bool = None):
+    store = interaction.client.store
+    guild_id = str(interaction.guild.id)
+    updates = {k: v for k, v in {
+        "headline": headline, "headline_color": headline_color, "headline_glow": headline_glow,
+        "name_color": name_color, "name_glow": name_glow, "count_color": count_color, "count_glow": count_glow,
+        "font": font, "headline_size": headline_size, "text_size": text_size, "avatar_x": avatar_x,
+        "text_x": text_x, "headline_y": headline_y, "name_y": name_y, "count_y": count_y,
+        "overlay_alpha": overlay_alpha, "animated": animated,
+    }.items() if v is not None}
+
+    if font is not None and (os.path.basename(font) != font or not os.path.isfile(os.path.join(FONTS_DIR, font))):
+        available = ", ".join(sorted(f for f in os.listdir(FONTS_DIR) if f.lower().endswith(FONT_EXTENSIONS)))
+        await interaction.response.send_message(f"❌ Unknown font. Available: {available}", ephemeral=True)
+        return
+
+    theme = {**store.banner_themes.get(guild_id, {}), **updates}
+    if updates:
+        store.banner_themes[guild_id] = theme
+        store.save("banner_themes")
+        invalidate_render_plan(store, interaction.guild.id)
+
+    effective = {**DEFAULT_BANNER_THEME, **theme}
+    text = "\n".join(f"`{k}`: {v}" + (" *(custom)*" if k in theme else "") for k, v in effective.items())
+    header = "✅ Banner theme updated. Try it with `/test_welcome`." if updates else "🎨 Current banner theme:"
+    await interaction.response.send_message(f"{header}\n{text}", ephemeral=True)
+
+@slash_command(name="banner_theme_reset", description="Reset this server's welcome banner to the default theme (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+async def banner_theme_reset(interaction: discord.Interaction):
+    store = interaction.client.store
+    store.banner_themes.pop(str(interaction.guild.id), None)
+    store.save("banner_themes")
+    invalidate_render_plan(store, interaction.guild.id)
+    await interaction.response.send_message("✅ Banner theme reset to default.", ephemeral=True)
+
 # -----------------------
 # Test welcome
 # -----------------------
-@bot.tree.command(name="test_welcome", description="Send a test welcome message to the configured welcome channel (admin only)")
+@slash_command(name="test_welcome", description="Send a test welcome message to the configured welcome channel (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
+@deferred_command()
 async def test_welcome(interaction: discord.Interaction, member: discord.Member = None):
-    # Defer the response immediately to avoid the timeout
-    await interaction.response.defer(ephemeral=True, thinking=True)
-    
+    store = interaction.client.store
+    trace = None
     try:
         member = member or interaction.user
         guild = interaction.guild
+        trace = JoinTrace("test_welcome", guild=guild.id, member=member.id)
         channel_id = get_welcome_channel_id(guild.id)
         if not channel_id:
             await interaction.followup.send("❌ No welcome channel configured in the code. Add it to WELCOME_CHANNELS variable.", ephemeral=True)
@@ -310,7 +2113,7 @@ async def test_welcome(interaction: discord.Interaction, member: discord.Member
             return
 
         # Use the same flow as on_member_join but with specified member
-        msgs = get_guild_messages(guild.id)
+        msgs = get_guild_messages(store, guild.id)
         template = random.choice(msgs)
         content_mention = template.format(mention=member.mention, username=member.name, server=guild.name)
 
@@ -323,18 +2126,17 @@ async def test_welcome(interaction: discord.Interaction, member: discord.Member
         embed.set_footer(text=f"Test • {datetime.utcnow().strftime('%B %d, %Y')}",
                          icon_url=str(guild.icon.url) if guild.icon else None)
 
-        banner_buffer = create_welcome_banner(member)
-        if banner_buffer:
-            file = File(banner_buffer, filename="welcome_banner.png")
-            embed.set_image(url="attachment://welcome_banner.png")
-            await channel.send(content=member.mention, embed=embed, file=file)
-        else:
-            await channel.send(content=member.mention, embed=embed)
+        with trace.span("banner"):
+            banner_buffer = await create_welcome_banner(store, member, trace)
+        via = await deliver_welcome(interaction.client, member, channel, embed, banner_buffer, trace)
+        trace.finish()
 
-        await interaction.followup.send("✅ Test welcome sent.", ephemeral=True)
+        await interaction.followup.send(f"✅ Test welcome sent (via {via}).", ephemeral=True)
         
     except Exception as e:
-        logger.error(f"Error in test_welcome command: {e}")
+        if trace:
+            trace.finish("error")
+        logger.error("Error in test_welcome command: %s", e)
         try:
             await interaction.followup.send("❌ Failed to send test welcome. See logs.", ephemeral=True)
         except:
@@ -393,6 +2195,42 @@ class CreateEmbedModal(discord.ui.Modal, title="Create Image Embeds"):
 # -----------------------
 # Helper: parse color hex or name (IMPROVED VERSION)
 # -----------------------
+# Extended color dictionary with common colors (built once at import)
+COLOR_NAMES = {
+    # Basic colors
+    "red": 0xFF0000, "green": 0x00FF00, "blue": 0x0000FF,
+    "yellow": 0xFFFF00, "orange": 0xFFA500, "purple": 0x800080,
+    "pink": 0xFFC0CB, "brown": 0xA52A2A, "black": 0x000000,
+    "white": 0xFFFFFF, "gray": 0x808080, "grey": 0x808080,
+    
+    # Discord colors
+    "blurple": 0x5865F2, "discord": 0x5865F2,
+    "crimson": 0xDC143C, "dark_theme": 0x36393F,
+    
+    # Additional common colors
+    "cyan": 0x00FFFF, "magenta": 0xFF00FF, "lime": 0x00FF00,
+    "maroon": 0x800000, "navy": 0x000080, "olive": 0x808000,
+    "teal": 0x008080, "silver": 0xC0C0C0, "gold": 0xFFD700,
+    "violet": 0xEE82EE, "indigo": 0x4B0082, "coral": 0xFF7F50,
+    "turquoise": 0x40E0D0, "salmon": 0xFA8072, "aqua": 0x00FFFF,
+    "fuchsia": 0xFF00FF, "khaki": 0xF0E68C, "lavender": 0xE6E6FA,
+    "plum": 0xDDA0DD, "orchid": 0xDA70D6, "azure": 0xF0FFFF,
+    "beige": 0xF5F5DC, "bisque": 0xFFE4C4, "chocolate": 0xD2691E,
+    "cornsilk": 0xFFF8DC, "firebrick": 0xB22222, "gainsboro": 0xDCDCDC,
+    "ghostwhite": 0xF8F8FF, "honeydew": 0xF0FFF0, "ivory": 0xFFFFF0,
+    "linen": 0xFAF0E6, "mintcream": 0xF5FFFA, "mistyrose": 0xFFE4E1,
+    "moccasin": 0xFFE4B5, "oldlace": 0xFDF5E6, "peru": 0xCD853F,
+    "seashell": 0xFFF5EE, "sienna": 0xA0522D, "snow": 0xFFFAFA,
+    "tan": 0xD2B48C, "thistle": 0xD8BFD8, "tomato": 0xFF6347,
+    "wheat": 0xF5DEB3, "whitesmoke": 0xF5F5F5,
+    
+    # Discord brand colors
+    "discord_red": 0xED4245, "discord_green": 0x57F287,
+    "discord_yellow": 0xFEE75C, "discord_blurple": 0x5865F2,
+    "discord_fuchsia": 0xEB459E, "discord_white": 0xFFFFFF,
+    "discord_black": 0x000000, "discord_gray": 0x36393F,
+}
+
 def parse_color(s: str):
     if not s:
         return 0xDC143C  # Default crimson
@@ -412,45 +2250,9 @@ def parse_color(s: str):
     except ValueError:
         pass  # Not a hex value, try color names
     
-    # Extended color dictionary with common colors
-    color_dict = {
-        # Basic colors
-        "red": 0xFF0000, "green": 0x00FF00, "blue": 0x0000FF,
-        "yellow": 0xFFFF00, "orange": 0xFFA500, "purple": 0x800080,
-        "pink": 0xFFC0CB, "brown": 0xA52A2A, "black": 0x000000,
-        "white": 0xFFFFFF, "gray": 0x808080, "grey": 0x808080,
-        
-        # Discord colors
-        "blurple": 0x5865F2, "discord": 0x5865F2,
-        "crimson": 0xDC143C, "dark_theme": 0x36393F,
-        
-        # Additional common colors
-        "cyan": 0x00FFFF, "magenta": 0xFF00FF, "lime": 0x00FF00,
-        "maroon": 0x800000, "navy": 0x000080, "olive": 0x808000,
-        "teal": 0x008080, "silver": 0xC0C0C0, "gold": 0xFFD700,
-        "violet": 0xEE82EE, "indigo": 0x4B0082, "coral": 0xFF7F50,
-        "turquoise": 0x40E0D0, "salmon": 0xFA8072, "aqua": 0x00FFFF,
-        "fuchsia": 0xFF00FF, "khaki": 0xF0E68C, "lavender": 0xE6E6FA,
-        "plum": 0xDDA0DD, "orchid": 0xDA70D6, "azure": 0xF0FFFF,
-        "beige": 0xF5F5DC, "bisque": 0xFFE4C4, "chocolate": 0xD2691E,
-        "cornsilk": 0xFFF8DC, "firebrick": 0xB22222, "gainsboro": 0xDCDCDC,
-        "ghostwhite": 0xF8F8FF, "honeydew": 0xF0FFF0, "ivory": 0xFFFFF0,
-        "linen": 0xFAF0E6, "mintcream": 0xF5FFFA, "mistyrose": 0xFFE4E1,
-        "moccasin": 0xFFE4B5, "oldlace": 0xFDF5E6, "peru": 0xCD853F,
-        "seashell": 0xFFF5EE, "sienna": 0xA0522D, "snow": 0xFFFAFA,
-        "tan": 0xD2B48C, "thistle": 0xD8BFD8, "tomato": 0xFF6347,
-        "wheat": 0xF5DEB3, "whitesmoke": 0xF5F5F5,
-        
-        # Discord brand colors
-        "discord_red": 0xED4245, "discord_green": 0x57F287,
-        "discord_yellow": 0xFEE75C, "discord_blurple": 0x5865F2,
-        "discord_fuchsia": 0xEB459E, "discord_white": 0xFFFFFF,
-        "discord_black": 0x000000, "discord_gray": 0x36393F,
-    }
-    
     # Try to find the color in the dictionary
-    if s in color_dict:
-        return color_dict[s]
+    if s in COLOR_NAMES:
+        return COLOR_NAMES[s]
     
     # Try to parse as RGB tuple (r,g,b)
     if s.startswith("(") and s.endswith(")"):
@@ -500,19 +2302,173 @@ def build_embed_from_data(data: dict, image_url: str = None):
 
     return embed
 
+# -----------------------
+# Embed batching (Discord payload limits, checked before sending)
+# -----------------------
+EMBEDS_PER_MESSAGE = 10
+EMBED_CHARS_PER_MESSAGE = 6000  # title + description + field names/values + footer + author, summed over the message
+
+class EmbedTooLarge(ValueError):
+    pass
+
+def chunk_embeds(embeds):
+    """Split embeds, in order, into the fewest consecutive batches that each fit one message.
+
+    Raises EmbedTooLarge if a single embed is over the per-message character limit on its own.
+    """
+    batches, current, chars = [], [], 0
+    for position, embed in enumerate(embeds, start=1):
+        size = len(embed)  # discord.Embed.__len__ counts exactly the fields Discord limits
+        if size > EMBED_CHARS_PER_MESSAGE:
+            raise EmbedTooLarge(f"Embed {position} has {size} characters of text; Discord allows {EMBED_CHARS_PER_MESSAGE} per message.")
+        if current and (len(current) == EMBEDS_PER_MESSAGE or chars + size > EMBED_CHARS_PER_MESSAGE):
+            batches.append(current)
+            current, chars = [], 0
+        current.append(embed)
+        chars += size
+    if current:
+        batches.append(current)
+    return batches
+
+async def send_batches(channel, content, batches):
+    """Send batches to one channel strictly in order (content rides on the first message).
+
+    Stops at the first failure so later parts never appear without the earlier ones. Returns (messages, error).
+    """
+    messages = []
+    for i, batch in enumerate(batches):
+        try:
+            messages.append(await channel.send(content=content if i == 0 else None, embeds=batch))
+        except discord.Forbidden:
+            return messages, "missing permissions"
+        except discord.HTTPException as e:
+            return messages, f"HTTP {e.status}: {e.text or 'request failed'}"
+        except Exception as e:
+            logger.exception("Embed send to %s failed", channel.id)
+            return messages, str(e) or type(e).__name__
+    return messages, None
+
+def record_sent_group(store: TenantStore, messages, batches):
+    """Register the messages of one post under a shared group_id (the first message's ID) when it spans several."""
+    group_id = str(messages[0].id) if len(batches) > 1 and messages else None
+    for part, (message, batch) in enumerate(zip(messages, batches), start=1):
+        record_sent_embed(store, message, batch, group_id=group_id, part=part, parts=len(batches))
+
+# -----------------------
+# Fan-out publishing (one payload -> many channels, across guilds)
+# -----------------------
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "4"))
+CHANNEL_REF_RE = re.compile(r"\d{15,21}")
+
+def parse_channel_refs(text: str):
+    """Extract channel IDs from a string of mentions (<#123>) and/or raw IDs, keeping order."""
+    seen = []
+    for match in CHANNEL_REF_RE.findall(text or ""):
+        cid = int(match)
+        if cid not in seen:
+            seen.append(cid)
+    return seen
+
+def resolve_fanout_targets(client: discord.Client, user_id: int, channel_ids):
+    """Resolve channel IDs the invoking admin may publish to. Returns (channels, rejected_ids)."""
+    channels, rejected = [], []
+    for cid in channel_ids:
+        channel = client.get_channel(cid)
+        member = channel.guild.get_member(user_id) if channel and getattr(channel, "guild", None) else None
+        # Cross-guild targets are only allowed where the invoker is an administrator too
+        if not channel or not hasattr(channel, "send") or not member or not member.guild_permissions.administrator:
+            rejected.append(cid)
+            continue
+        channels.append(channel)
+    return channels, rejected
+
+async def fan_out_send(channels, content, batches, concurrency: int = FANOUT_CONCURRENCY):
+    """Send the same batched payload to every channel with at most `concurrency` channels in flight.
+
+    Each channel gets its batches in order; channels don't wait on each other's later parts.
+    Returns one result dict per channel, in input order:
+    {"channel", "messages", "latency_ms", "error"}.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def send_one(channel):
+        FANOUT_IN_FLIGHT.inc()
+        try:
+            async with semaphore:
+                started = time.perf_counter()
+                messages, error = await send_batches(channel, content, batches)
+                latency_ms = (time.perf_counter() - started) * 1000
+                return {"channel": channel, "messages": messages, "latency_ms": latency_ms, "error": error}
+        finally:
+            FANOUT_IN_FLIGHT.dec()
+
+    return await asyncio.gather(*(send_one(c) for c in channels))
+
+async def fan_out_embeds(interaction: discord.Interaction, channels, extra, batches, skipped=()):
+    """Send to every channel and report one row per target, including `skipped`: (channel_id, reason) pairs
+    for targets that never got a send (rejected when the modal opened, or gone by the time it was submitted)."""
+    store = interaction.client.store
+    results = await fan_out_send(channels, extra, batches)
+
+    # One persistence write for the whole batch
+    delivered = 0
+    for result in results:
+        if result["messages"]:
+            record_sent_group(store, result["messages"], batches)
+        if not result["error"]:
+            delivered += 1
+    if any(result["messages"] for result in results):
+        store.save("sent_embeds")
+
+    lines = []
+    for result in results:
+        channel = result["channel"]
+        where = f"{channel.mention} ({channel.guild.name})"
+        if result["error"]:
+            partial = f" after {len(result['messages'])}/{len(batches)} message(s)" if result["messages"] else ""
+            lines.append(f"❌ {where} — {result['error']}{partial} ({result['latency_ms']:.0f} ms)")
+        else:
+            lines.append(f"✅ {where} — {result['latency_ms']:.0f} ms")
+    for channel_id, reason in skipped:
+        lines.append(f"❌ <#{channel_id}> — {reason}")
+    embed_count = sum(len(batch) for batch in batches)
+    parts = f" in {len(batches)} messages" if len(batches) > 1 else ""
+    summary = f"📣 Sent {embed_count} embed(s){parts} to {delivered}/{len(results) + len(skipped)} channel(s):\n" + "\n".join(lines)
+    if len(summary) > 2000:
+        summary = summary[:1996] + "\n…"
+    await interaction.followup.send(summary, ephemeral=True)
+    return results
+
 # -----------------------
 # Core processing for embed creation (called from modal)
 # -----------------------
 async def process_create_embed(interaction: discord.Interaction, data: dict):
-    target_channel_id = data.get("target_channel_id")
-    if target_channel_id is None:
-        await interaction.followup.send("❌ No target channel specified.", ephemeral=True)
-        return
+    store = interaction.client.store
     guild = interaction.guild
-    target_channel = guild.get_channel(int(target_channel_id))
-    if not target_channel:
-        await interaction.followup.send("❌ Target channel not found.", ephemeral=True)
-        return
+    target_channel_ids = data.get("target_channel_ids")
+    if target_channel_ids:
+        # Fan-out mode: channels were resolved and permission-checked when the modal was opened
+        target_channels, skipped = [], [(cid, "not available to you") for cid in data.get("rejected_channel_ids", [])]
+        for cid in target_channel_ids:
+            channel = interaction.client.get_channel(int(cid))
+            if channel:
+                target_channels.append(channel)
+            else:
+                skipped.append((cid, "channel no longer exists"))
+        if not target_channels:
+            await interaction.followup.send("❌ None of the target channels could be found.", ephemeral=True)
+            return
+        target_channel = target_channels[0]
+    else:
+        target_channel_id = data.get("target_channel_id")
+        if target_channel_id is None:
+            await interaction.followup.send("❌ No target channel specified.", ephemeral=True)
+            return
+        target_channel = guild.get_channel(int(target_channel_id))
+        if not target_channel:
+            await interaction.followup.send("❌ Target channel not found.", ephemeral=True)
+            return
+        target_channels = None
     
     # Build embeds
     embeds = []
@@ -549,31 +2505,46 @@ async def process_create_embed(interaction: discord.Interaction, data: dict):
     extra = data.get("extra_content") or None
     preview = data.get("preview", False)
 
+    # Discord rejects >10 embeds or >6000 characters per message; split locally instead of finding out the hard way
+    try:
+        batches = chunk_embeds(embeds)
+    except EmbedTooLarge as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        return
+
     if preview:
-        try:
-            dm = await interaction.user.create_dm()
-            await dm.send(content=extra or None, embeds=embeds)
-            await interaction.followup.send("✅ Preview sent to your DMs.", ephemeral=True)
-        except discord.Forbidden:
+        dm = await interaction.user.create_dm()
+        messages, error = await send_batches(dm, extra, batches)
+        if error == "missing permissions":
             await interaction.followup.send("❌ Couldn't DM you (maybe DMs disabled).", ephemeral=True)
+        elif error:
+            await interaction.followup.send(f"❌ Preview failed: {error}", ephemeral=True)
+        else:
+            await interaction.followup.send("✅ Preview sent to your DMs.", ephemeral=True)
         return
 
-    # Send embeds to target channel
-    try:
-        sent = await target_channel.send(content=extra or None, embeds=embeds)
-        sent_embeds[str(sent.id)] = {"guild_id": guild.id, "channel_id": target_channel.id}
-        save_json(SENT_EMBEDS_FILE, sent_embeds)
-        await interaction.followup.send(f"✅ {len(embeds)} embed(s) sent to {target_channel.mention}", ephemeral=True)
-    except discord.Forbidden:
+    if target_channels is not None:
+        return await fan_out_embeds(interaction, target_channels, extra, batches, skipped)
+
+    # Send embeds to target channel, one message per batch, in order
+    messages, error = await send_batches(target_channel, extra, batches)
+    if messages:
+        record_sent_group(store, messages, batches)
+        store.save("sent_embeds")
+    if not error:
+        parts = f" in {len(batches)} messages" if len(batches) > 1 else ""
+        await interaction.followup.send(f"✅ {len(embeds)} embed(s) sent to {target_channel.mention}{parts}", ephemeral=True)
+    elif error == "missing permissions" and not messages:
         await interaction.followup.send("❌ I don't have permission to send messages in the target channel.", ephemeral=True)
-    except Exception as e:
-        logger.exception("Failed to send embed")
-        await interaction.followup.send("❌ Failed to send embed. See logs.", ephemeral=True)
+    elif messages:
+        await interaction.followup.send(f"⚠️ Sent {len(messages)}/{len(batches)} messages to {target_channel.mention}, then: {error}", ephemeral=True)
+    else:
+        await interaction.followup.send(f"❌ Failed to send embed: {error}", ephemeral=True)
 
 # -----------------------
 # Slash: create_embed (opens modal)
 # -----------------------
-@bot.tree.command(name="create_embed", description="Create and send a custom embed (admin only). Use the modal to add fields.")
+@slash_command(name="create_embed", description="Create and send a custom embed (admin only). Use the modal to add fields.")
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
     channel="Channel to send the embed to",
@@ -621,10 +2592,115 @@ async def create_embed_cmd(interaction: discord.Interaction,
         logger.exception("Failed to open modal")
         await interaction.response.send_message("❌ Failed to open modal. Try again.", ephemeral=True)
 
+# -----------------------
+# Slash: broadcast_embed + channel groups (fan-out publishing)
+# -----------------------
+@slash_command(name="broadcast_embed", description="Send one embed to several channels or a saved channel group (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    channels="Channel mentions or IDs, separated by spaces or commas (can span servers)",
+    group="Name of a saved channel group (see /channel_group_save)",
+    color="Color (hex like #ff00aa or name)",
+    thumbnail_url="Thumbnail image URL (optional)",
+    author_name="Author name (optional)",
+    author_icon_url="Author icon URL (optional)",
+    footer_icon_url="Footer icon URL (optional)",
+    timestamp="Include timestamp"
+)
+async def broadcast_embed_cmd(interaction: discord.Interaction,
+                              channels: str = None,
+                              group: str = None,
+                              color: str = "#DC143C",
+                              thumbnail_url: str = None,
+                              author_name: str = None,
+                              author_icon_url: str = None,
+                              footer_icon_url: str = None,
+                              timestamp: bool = False):
+    store = interaction.client.store
+    channel_ids = parse_channel_refs(channels)
+    if group:
+        group_ids = store.channel_groups.get(str(interaction.guild.id), {}).get(group.lower())
+        if group_ids is None:
+            await interaction.response.send_message(f"❌ No channel group named `{group}`.", ephemeral=True)
+            return
+        channel_ids += [cid for cid in group_ids if cid not in channel_ids]
+    if not channel_ids:
+        await interaction.response.send_message("❌ Give at least one channel or a channel group.", ephemeral=True)
+        return
+
+    bad = [name for name, url in (("thumbnail_url", thumbnail_url), ("author_icon_url", author_icon_url),
+                                  ("footer_icon_url", footer_icon_url))
+           if url and not (url.startswith("http://") or url.startswith("https://"))]
+    if bad:
+        await interaction.response.send_message(f"❌ These URLs look invalid: {', '.join(bad)}", ephemeral=True)
+        return
+
+    targets, rejected = resolve_fanout_targets(interaction.client, interaction.user.id, channel_ids)
+    if not targets:
+        await interaction.response.send_message("❌ None of those channels are available to you.", ephemeral=True)
+        return
+    if rejected:
+        logger.info("broadcast_embed: skipped %d unavailable channel(s): %s", len(rejected), rejected)
+
+    callback_data = {
+        "target_channel_ids": [c.id for c in targets],
+        "rejected_channel_ids": rejected,  # reported as failed rows in the fan-out summary
+        "color": color,
+        "thumbnail_url": thumbnail_url,
+        "author_name": author_name,
+        "author_icon_url": author_icon_url,
+        "footer_icon_url": footer_icon_url,
+        "timestamp_on": timestamp,
+        "preview": False
+    }
+    try:
+        await interaction.response.send_modal(CreateEmbedModal(callback_data))
+    except Exception:
+        logger.exception("Failed to open modal")
+        await interaction.response.send_message("❌ Failed to open modal. Try again.", ephemeral=True)
+
+@slash_command(name="channel_group_save", description="Save (or replace) a named group of channels for /broadcast_embed (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(name="Group name", channels="Channel mentions or IDs, separated by spaces or commas")
+async def channel_group_save(interaction: discord.Interaction, name: str, channels: str):
+    store = interaction.client.store
+    channel_ids = parse_channel_refs(channels)
+    targets, rejected = resolve_fanout_targets(interaction.client, interaction.user.id, channel_ids)
+    if not targets:
+        await interaction.response.send_message("❌ None of those channels are available to you.", ephemeral=True)
+        return
+    groups = store.channel_groups.setdefault(str(interaction.guild.id), {})
+    groups[name.lower()] = [c.id for c in targets]
+    store.save("channel_groups")
+    note = f" (skipped {len(rejected)} unavailable)" if rejected else ""
+    await interaction.response.send_message(f"✅ Saved group `{name.lower()}` with {len(targets)} channel(s){note}.", ephemeral=True)
+
+@slash_command(name="channel_group_list", description="List saved channel groups (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+async def channel_group_list(interaction: discord.Interaction):
+    store = interaction.client.store
+    groups = store.channel_groups.get(str(interaction.guild.id), {})
+    if not groups:
+        await interaction.response.send_message("No channel groups saved.", ephemeral=True)
+        return
+    text = "\n".join(f"• `{name}`: " + " ".join(f"<#{cid}>" for cid in ids) for name, ids in groups.items())
+    await interaction.response.send_message(f"📂 Channel groups:\n{text}"[:2000], ephemeral=True)
+
+@slash_command(name="channel_group_delete", description="Delete a saved channel group (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+async def channel_group_delete(interaction: discord.Interaction, name: str):
+    store = interaction.client.store
+    groups = store.channel_groups.get(str(interaction.guild.id), {})
+    if groups.pop(name.lower(), None) is None:
+        await interaction.response.send_message(f"❌ No channel group named `{name}`.", ephemeral=True)
+        return
+    store.save("channel_groups")
+    await interaction.response.send_message(f"Removed group `{name.lower()}`.", ephemeral=True)
+
 # -----------------------
 # Edit embed
 # -----------------------
-@bot.tree.command(name="edit_embed", description="Edit an embed previously sent by the bot (admin only)")
+@slash_command(name="edit_embed", description="Edit an embed previously sent by the bot (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
     message_id="Message ID of the embed the bot sent", 
@@ -639,28 +2715,30 @@ async def create_embed_cmd(interaction: discord.Interaction,
     new_author_icon="New author icon URL",
     new_content="New message content (outside embed, use 'clear' to remove)"
 )
+@deferred_command()
 async def edit_embed(interaction: discord.Interaction, message_id: str, embed_index: int = 1, 
                     new_title: str = None, new_description: str = None, 
                     new_footer: str = None, new_color: str = None,
                     new_image: str = None, new_thumbnail: str = None,
                     new_author_name: str = None, new_author_icon: str = None,
                     new_content: str = None):
-    info = sent_embeds.get(str(message_id))
+    store = interaction.client.store
+    info = store.sent_embeds.get(str(message_id))
     if not info:
-        await interaction.response.send_message("❌ I don't have that message recorded as a sent embed.", ephemeral=True)
+        await interaction.followup.send("❌ I don't have that message recorded as a sent embed.", ephemeral=True)
         return
     guild_id = info.get("guild_id")
     channel_id = info.get("channel_id")
     if guild_id != interaction.guild.id:
-        await interaction.response.send_message("❌ That embed belongs to a different guild.", ephemeral=True)
+        await interaction.followup.send("❌ That embed belongs to a different guild.", ephemeral=True)
         return
     channel = interaction.guild.get_channel(channel_id)
     if not channel:
-        await interaction.response.send_message("❌ Channel not found.", ephemeral=True)
+        await interaction.followup.send("❌ Channel not found.", ephemeral=True)
         return
     
     if embed_index < 1:
-        await interaction.response.send_message("❌ Embed index must be at least 1.", ephemeral=True)
+        await interaction.followup.send("❌ Embed index must be at least 1.", ephemeral=True)
         return
     
     # Validate URLs if provided
@@ -673,21 +2751,21 @@ async def edit_embed(interaction: discord.Interaction, message_id: str, embed_in
     for url_name, url in urls_to_validate.items():
         if url and url != "clear":
             if not (url.startswith("http://") or url.startswith("https://")):
-                await interaction.response.send_message(f"❌ {url_name} must start with http:// or https://", ephemeral=True)
+                await interaction.followup.send(f"❌ {url_name} must start with http:// or https://", ephemeral=True)
                 return
     
     try:
         msg = await channel.fetch_message(int(message_id))
     except Exception:
-        await interaction.response.send_message("❌ Could not fetch that message (it may have been deleted).", ephemeral=True)
+        await interaction.followup.send("❌ Could not fetch that message (it may have been deleted).", ephemeral=True)
         return
     
     if not msg.embeds:
-        await interaction.response.send_message("❌ That message has no embeds.", ephemeral=True)
+        await interaction.followup.send("❌ That message has no embeds.", ephemeral=True)
         return
     
     if embed_index > len(msg.embeds):
-        await interaction.response.send_message(f"❌ That message only has {len(msg.embeds)} embed(s).", ephemeral=True)
+        await interaction.followup.send(f"❌ That message only has {len(msg.embeds)} embed(s).", ephemeral=True)
         return
     
     embed = msg.embeds[embed_index - 1]
@@ -729,7 +2807,7 @@ async def edit_embed(interaction: discord.Interaction, message_id: str, embed_in
         new_embed.set_author(name=embed.author.name, icon_url=embed.author.icon_url or None)
     elif new_author_icon is not None:
         # Only icon change requested but no author name exists
-        await interaction.response.send_message("❌ Cannot set author icon without author name. Use new_author_name parameter.", ephemeral=True)
+        await interaction.followup.send("❌ Cannot set author icon without author name. Use new_author_name parameter.", ephemeral=True)
         return
     
     # Handle footer
@@ -777,16 +2855,109 @@ async def edit_embed(interaction: discord.Interaction, message_id: str, embed_in
             changes.append(f"content to '{new_content}'" if new_content != "clear" else "content")
         
         change_text = ", ".join(changes) if changes else "nothing (no changes specified)"
-        await interaction.response.send_message(f"✅ Edited embed #{embed_index}: {change_text}.", ephemeral=True)
+        await interaction.followup.send(f"✅ Edited embed #{embed_index}: {change_text}.", ephemeral=True)
     except discord.Forbidden:
-        await interaction.response.send_message("❌ Missing permission to edit that message.", ephemeral=True)
+        await interaction.followup.send("❌ Missing permission to edit that message.", ephemeral=True)
     except Exception as e:
         logger.exception("Failed to edit embed")
-        await interaction.response.send_message("❌ Failed to edit embed. See logs.", ephemeral=True)
+        await interaction.followup.send("❌ Failed to edit embed. See logs.", ephemeral=True)
+
+# -----------------------
+# List sent embeds (indexed, cursor-paginated)
+# -----------------------
+LIST_EMBEDS_PAGE_SIZE = 10
+
+def parse_date_bound(text: str, end_of_day: bool = False):
+    """YYYY-MM-DD (UTC) -> snowflake bound. Start of day for since, start of the next day for until."""
+    day = datetime.strptime(text.strip(), "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    if end_of_day:
+        day += timedelta(days=1)
+    return discord.utils.time_snowflake(day)
+
+def embed_list_page(store: TenantStore, guild: discord.Guild, channel_id, after, before):
+    ids, cursor = store.sent_embed_index.page(guild.id, channel_id, before=before, after=after, limit=LIST_EMBEDS_PAGE_SIZE)
+    where = f"<#{channel_id}>" if channel_id else guild.name
+    page = discord.Embed(title=f"Sent embeds in {where}", color=discord.Color.blurple())
+    lines = []
+    for message_id in ids:
+        info = store.sent_embeds.get(str(message_id), {})
+        sent_at = int(discord.utils.snowflake_time(message_id).timestamp())
+        link = f"https://discord.com/channels/{guild.id}/{info.get('channel_id')}/{message_id}"
+        title = discord.utils.escape_markdown(info.get("title") or "untitled")[:60]
+        part = f" · part {info['part']}/{info['parts']}" if info.get("group_id") else ""
+        lines.append(f"<t:{sent_at}:d> <#{info.get('channel_id')}> [{title}]({link}){part} · `{message_id}`")
+    page.description = "\n".join(lines) or "No recorded embeds match."
+    if cursor:
+        page.set_footer(text=f"More with cursor:{cursor}")
+    return page, cursor
+
+class EmbedListView(discord.ui.View):
+    """Older/Newer buttons over the tenant's sent_embed_index. Keeps the cursors it has visited so Newer can step back."""
+
+    def __init__(self, store: TenantStore, owner_id: int, guild: discord.Guild, channel_id, after, before, cursor):
+        super().__init__(timeout=300)
+        self.store = store
+        self.owner_id = owner_id
+        self.guild = guild
+        self.channel_id = channel_id
+        self.after = after
+        self.history = [before]
+        self.cursor = cursor
+        self._sync_buttons()
+
+    def _sync_buttons(self):
+        self.newer.disabled = len(self.history) == 1
+        self.older.disabled = self.cursor is None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.owner_id
+
+    async def _show(self, interaction: discord.Interaction):
+        page, self.cursor = embed_list_page(self.store, self.guild, self.channel_id, self.after, self.history[-1])
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=page, view=self)
+
+    @discord.ui.button(label="◀ Newer", style=discord.ButtonStyle.secondary)
+    async def newer(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.history.pop()
+        await self._show(interaction)
+
+    @discord.ui.button(label="Older ▶", style=discord.ButtonStyle.secondary)
+    async def older(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.history.append(self.cursor)
+        await self._show(interaction)
+
+@slash_command(name="list_embeds", description="List embeds the bot has sent in this server, newest first (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    channel="Only embeds sent to this channel",
+    since="Only embeds sent on or after this date (YYYY-MM-DD, UTC)",
+    until="Only embeds sent on or before this date (YYYY-MM-DD, UTC)",
+    cursor="Continue an earlier listing from the cursor shown in its footer"
+)
+async def list_embeds(interaction: discord.Interaction, channel: discord.TextChannel = None,
+                      since: str = None, until: str = None, cursor: str = None):
+    try:
+        after = parse_date_bound(since) - 1 if since else None
+        before = parse_date_bound(until, end_of_day=True) if until else None
+    except ValueError:
+        await interaction.response.send_message("❌ Dates must look like 2024-01-31.", ephemeral=True)
+        return
+    if cursor:
+        if not cursor.isdigit():
+            await interaction.response.send_message("❌ Cursor must be a message ID.", ephemeral=True)
+            return
+        before = min(int(cursor), before) if before else int(cursor)
+
+    channel_id = channel.id if channel else None
+    store = interaction.client.store
+    page, next_cursor = embed_list_page(store, interaction.guild, channel_id, after, before)
+    view = EmbedListView(store, interaction.user.id, interaction.guild, channel_id, after, before, next_cursor)
+    await interaction.response.send_message(embed=page, view=view, ephemeral=True)
 
 # DM 
 
-@bot.tree.command(name="dm", description="Send a DM to a member (admin only)")
+@slash_command(name="dm", description="Send a DM to a member (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
     member="The member to DM",
@@ -796,18 +2967,19 @@ async def edit_embed(interaction: discord.Interaction, message_id: str, embed_in
     image_url="Image URL for embed (optional)",
     color="Embed color (optional)"
 )
+@deferred_command()
 async def dm_combined(interaction: discord.Interaction, member: discord.Member, 
                      message: str = None, title: str = None, 
                      description: str = None, image_url: str = None, color: str = None):
     try:
         if not message and not title and not description and not image_url:
-            await interaction.response.send_message("❌ Need either a message, embed content, or image", ephemeral=True)
+            await interaction.followup.send("❌ Need either a message, embed content, or image", ephemeral=True)
             return
         
         # Validate image URL if provided
         if image_url and image_url != "clear":
             if not (image_url.startswith("http://") or image_url.startswith("https://")):
-                await interaction.response.send_message("❌ Image URL must start with http:// or https://", ephemeral=True)
+                await interaction.followup.send("❌ Image URL must start with http:// or https://", ephemeral=True)
                 return
             
         if title or description or image_url:
@@ -829,28 +3001,29 @@ async def dm_combined(interaction: discord.Interaction, member: discord.Member,
             # Send plain text only
             await member.send(message)
             
-        await interaction.response.send_message(f"✅ DM sent to {member.mention}", ephemeral=True)
+        await interaction.followup.send(f"✅ DM sent to {member.mention}", ephemeral=True)
     except discord.Forbidden:
-        await interaction.response.send_message("❌ Cannot send DM (user has DMs disabled or blocked the bot)", ephemeral=True)
+        await interaction.followup.send("❌ Cannot send DM (user has DMs disabled or blocked the bot)", ephemeral=True)
     except Exception as e:
-        logger.error(f"Failed to send DM: {e}")
-        await interaction.response.send_message("❌ Failed to send DM. See logs.", ephemeral=True)
+        logger.error("Failed to send DM: %s", e)
+        await interaction.followup.send("❌ Failed to send DM. See logs.", ephemeral=True)
 
 # -----------------------
 # Plain Text Message Command
 # -----------------------
-@bot.tree.command(name="message", description="Send a plain text message to a channel (admin only)")
+@slash_command(name="message", description="Send a plain text message to a channel (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
     channel="Channel to send the message to",
     content="The text message to send",
     reply_to="Message ID to reply to (optional)"
 )
+@deferred_command()
 async def send_message(interaction: discord.Interaction, channel: discord.TextChannel, content: str, reply_to: str = None):
     try:
         # Validate content length
         if len(content) > 2000:
-            await interaction.response.send_message("❌ Message too long (max 2000 characters)", ephemeral=True)
+            await interaction.followup.send("❌ Message too long (max 2000 characters)", ephemeral=True)
             return
         
         # Prepare reply reference if provided
@@ -865,7 +3038,7 @@ async def send_message(interaction: discord.Interaction, channel: discord.TextCh
                     fail_if_not_exists=False
                 )
             except:
-                await interaction.response.send_message("❌ Could not find the message to reply to", ephemeral=True)
+                await interaction.followup.send("❌ Could not find the message to reply to", ephemeral=True)
                 return
         
         # Send the plain text message
@@ -874,18 +3047,20 @@ async def send_message(interaction: discord.Interaction, channel: discord.TextCh
         else:
             sent = await channel.send(content)
         
-        await interaction.response.send_message(f"✅ Message sent to {channel.mention}", ephemeral=True)
+        await interaction.followup.send(f"✅ Message sent to {channel.mention}", ephemeral=True)
         
     except discord.Forbidden:
-        await interaction.response.send_message("❌ I don't have permission to send messages in that channel", ephemeral=True)
+        await interaction.followup.send("❌ I don't have permission to send messages in that channel", ephemeral=True)
     except Exception as e:
-        logger.error(f"Failed to send message: {e}")
-        await interaction.response.send_message("❌ Failed to send message. See logs.", ephemeral=True)
+        logger.error("Failed to send message: %s", e)
+        await interaction.followup.send("❌ Failed to send message. See logs.", ephemeral=True)
 
 # -----------------------
 # Image Only Command (No Embed) with Reply
 # -----------------------
-@bot.tree.command(name="send_image", description="Send an image without embed (admin only)")
+RELAY_IMAGE_MAX_BYTES = 25 * 1024 * 1024  # Discord's default upload limit; anything bigger would fail on send
+
+@slash_command(name="send_image", description="Send an image without embed (admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
     channel="Channel to send the image to",
@@ -893,11 +3068,12 @@ async def send_message(interaction: discord.Interaction, channel: discord.TextCh
     message="Optional text message with the image",
     reply_to="Message ID to reply to (optional)"
 )
+@deferred_command()
 async def send_image(interaction: discord.Interaction, channel: discord.TextChannel, image_url: str, message: str = None, reply_to: str = None):
     try:
         # Validate URL
         if not (image_url.startswith("http://") or image_url.startswith("https://")):
-            await interaction.response.send_message("❌ Image URL must start with http:// or https://", ephemeral=True)
+            await interaction.followup.send("❌ Image URL must start with http:// or https://", ephemeral=True)
             return
         
         # Prepare reply reference if provided
@@ -912,13 +3088,17 @@ async def send_image(interaction: discord.Interaction, channel: discord.TextChan
                     fail_if_not_exists=False
                 )
             except:
-                await interaction.response.send_message("❌ Could not find the message to reply to", ephemeral=True)
+                await interaction.followup.send("❌ Could not find the message to reply to", ephemeral=True)
                 return
         
         # Download the image
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            await interaction.response.send_message("❌ Failed to download image from URL", ephemeral=True)
+        try:
+            response = await http_client.get(image_url, max_bytes=RELAY_IMAGE_MAX_BYTES)
+        except HttpError as e:
+            logger.warning("Image download failed: %s", e)
+            response = None
+        if response is None or response.status != 200:
+            await interaction.followup.send("❌ Failed to download image from URL", ephemeral=True)
             return
         
         # Get file extension from URL or content type
@@ -942,17 +3122,283 @@ async def send_image(interaction: discord.Interaction, channel: discord.TextChan
         else:
             await channel.send(content=message, file=file)
         
-        await interaction.response.send_message(f"✅ Image sent to {channel.mention}", ephemeral=True)
+        await interaction.followup.send(f"✅ Image sent to {channel.mention}", ephemeral=True)
         
     except discord.Forbidden:
-        await interaction.response.send_message("❌ I don't have permission to send messages in that channel", ephemeral=True)
+        await interaction.followup.send("❌ I don't have permission to send messages in that channel", ephemeral=True)
     except Exception as e:
-        logger.error(f"Failed to send image: {e}")
-        await interaction.response.send_message("❌ Failed to send image. See logs.", ephemeral=True)
+        logger.error("Failed to send image: %s", e)
+        await interaction.followup.send("❌ Failed to send image. See logs.", ephemeral=True)
+
+# -----------------------
+# Memory profiling (tracemalloc on demand + object census)
+# -----------------------
+MEMORY_PROFILE_FRAMES = int(os.getenv("MEMORY_PROFILE_FRAMES", "10"))  # stack depth recorded per allocation
+MEMORY_PROFILE_TOP_N = 8
+MEMORY_CENSUS_INTERVAL = float(os.getenv("MEMORY_CENSUS_INTERVAL", "60"))  # 0 disables the periodic census
+# Allocations made by the profiler itself or by imports are noise when hunting a leak
+MEMORY_PROFILE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+MEMORY_OBJECTS = Gauge("memory_objects", "Cached / live objects by tenant and kind, from the latest census", ["tenant", "kind"])
+MEMORY_PROFILE_GROWTH = Gauge("memory_profile_growth_bytes", "Traced growth between the last two /memory_profile snapshots")
+TRACEMALLOC_TRACED = Gauge("tracemalloc_traced_bytes", "Memory traced by tracemalloc (0 while it is off)",
+                           function=lambda: tracemalloc.get_traced_memory()[0])
+TRACEMALLOC_OVERHEAD = Gauge("tracemalloc_overhead_bytes", "Memory tracemalloc uses for its own traces",
+                             function=tracemalloc.get_tracemalloc_memory)
+
+def format_size(n: float, signed: bool = False) -> str:
+    sign = "+" if signed else ""
+    return f"{n / 2**20:{sign}.1f} MB" if abs(n) >= 2**20 else f"{n / 1024:{sign}.0f} KB"
+
+def cache_census():
+    """Sizes of the caches that grow with traffic, per tenant ("" for process-wide ones). Cheap; runs on the loop."""
+    counts = {}
+    for client in tenants:
+        counts[client.tenant] = {
+            "guilds": len(client.guilds),
+            "members": sum(len(guild.members) for guild in client.guilds),
+            "users": len(client.users),
+            "messages": len(client.cached_messages),
+            "sent_embeds": len(client.store.sent_embeds),
+            "render_plans": len(client.store.render_plans),
+            "join_claims": len(client.store.join_dedupe),
+        }
+    counts[""] = {
+        "avatar_cache": len(avatar_cache),
+        "http_connections": http_client.connection_count(),
+        "asyncio_tasks": len(asyncio.all_tasks()),
+    }
+    return counts
+
+def heap_census():
+    """Live PIL images and BytesIO buffers (with their approximate sizes) found by walking the GC heap.
+
+    PIL allocates pixel data outside Python's allocator, so tracemalloc never sees it; this is the only view of it.
+    O(heap size), so run it in a worker thread; it only inspects objects, never mutates them.
+    """
+    counts = {"pil_images": 0, "pil_image_bytes": 0, "bytesio_buffers": 0, "bytesio_bytes": 0}
+    for obj in gc.get_objects():
+        try:
+            if isinstance(obj, Image.Image):
+                counts["pil_images"] += 1
+                counts["pil_image_bytes"] += obj.width * obj.height * len(obj.getbands())
+            elif isinstance(obj, BytesIO):
+                counts["bytesio_buffers"] += 1
+                counts["bytesio_bytes"] += sys.getsizeof(obj)
+        except Exception:
+            continue  # half-constructed or closed objects
+    return counts
+
+def record_census(counts):
+    for tenant, kinds in counts.items():
+        for kind, value in kinds.items():
+            MEMORY_OBJECTS.set(value, tenant=tenant, kind=kind)
+
+async def run_memory_census(interval: float = MEMORY_CENSUS_INTERVAL):
+    # Only the cheap cache counts; the heap walk runs when /memory_profile asks for it
+    while True:
+        record_census(cache_census())
+        await asyncio.sleep(interval)
+
+class MemoryProfiler:
+    """Starts and stops tracemalloc at runtime and diffs snapshots, so growth can be traced without a restart.
+
+    Snapshots are reduced to {allocation site: (bytes, blocks)} straight away, where a site is the allocating
+    line plus the innermost line of this file on its stack (so PIL or aiohttp allocations still point at the
+    code that caused them). Each snapshot is compared with the previous one and with the first. All methods
+    block for up to seconds on a large heap: call them through asyncio.to_thread.
+    """
+
+    def __init__(self):
+        lines, first = inspect.getsourcelines(type(self))
+        self.own_lines = range(first, first + len(lines))  # the profiler's own bookkeeping isn't a leak
+        self.started_at = None
+        self.frames = None
+        self.first = None
+        self.previous = None
+        self.previous_at = None
+        self.last_census = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def _site(self, traceback_):
+        frames = list(traceback_)  # oldest first
+        if any(f.filename == __file__ and f.lineno in self.own_lines for f in frames):
+            return None
+        innermost = frames[-1]
+        site = f"{os.path.basename(innermost.filename)}:{innermost.lineno}"
+        ours = next((f for f in reversed(frames) if f.filename == __file__), None)
+        if ours is not None and ours is not innermost:
+            site += f" ← main.py:{ours.lineno}"
+        return site
+
+    def _take(self):
+        sites = {}
+        snapshot = tracemalloc.take_snapshot().filter_traces(MEMORY_PROFILE_FILTERS)
+        for stat in snapshot.statistics("traceback"):
+            site = self._site(stat.traceback)
+            if site is None:
+                continue
+            size, count = sites.get(site, (0, 0))
+            sites[site] = (size + stat.size, count + stat.count)
+        return sites
+
+    def start(self, frames: int = MEMORY_PROFILE_FRAMES):
+        with self._lock:
+            tracemalloc.start(frames)
+            self.started_at = self.previous_at = time.time()
+            self.frames = frames
+            self.first = self.previous = self._take()
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self.started_at = self.previous_at = self.frames = None
+            self.first = self.previous = None
+
+    @staticmethod
+    def _growth(current, base, top_n):
+        diffs = []
+        for site, (size, count) in current.items():
+            old_size, old_count = base.get(site, (0, 0))
+            if size > old_size:
+                diffs.append((site, size - old_size, count - old_count, size))
+        diffs.sort(key=lambda d: d[1], reverse=True)
+        return diffs[:top_n]
+
+    def snapshot(self, top_n: int = MEMORY_PROFILE_TOP_N) -> dict:
+        """Growth since the previous snapshot and since start, plus the largest sites right now."""
+        with self._lock:
+            current = self._take()
+            if self.first is None:  # tracing was started outside the bot (PYTHONTRACEMALLOC)
+                self.first, self.previous, self.previous_at = current, current, time.time()
+            total, previous_total = sum(s for s, _ in current.values()), sum(s for s, _ in self.previous.values())
+            report = {
+                "interval_s": time.time() - self.previous_at,
+                "traced": total,
+                "growth": total - previous_total,
+                "since_last": self._growth(current, self.previous, top_n),
+                "since_start": self._growth(current, self.first, top_n),
+                "largest": sorted(((site, size, count) for site, (size, count) in current.items()),
+                                  key=lambda d: d[1], reverse=True)[:top_n],
+            }
+            self.previous, self.previous_at = current, time.time()
+        MEMORY_PROFILE_GROWTH.set(report["growth"])
+        return report
+
+memory_profiler = MemoryProfiler()
+
+# -----------------------
+# Diagnostics
+# -----------------------
+@slash_command(name="loop_stalls", description="Show the handlers that blocked the event loop the longest (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+async def loop_stalls(interaction: discord.Interaction, show_stack: bool = False):
+    top = loop_watchdog.top()
+    if not top:
+        await interaction.response.send_message(f"✅ No event-loop stalls over {LOOP_STALL_THRESHOLD_MS:.0f} ms recorded.", ephemeral=True)
+        return
+    lines = []
+    for i, ((handler, location), entry) in enumerate(top, 1):
+        lines.append(f"{i}. `{handler}` — {entry['count']}× total {entry['total_ms']:.0f} ms, max {entry['max_ms']:.0f} ms\n   `{location}`")
+    text = f"🐢 Top event-loop stalls (> {LOOP_STALL_THRESHOLD_MS:.0f} ms):\n" + "\n".join(lines)
+    if show_stack:
+        text += f"\n**Worst offender stack:**\n```{top[0][1]['stack'][-1200:]}```"
+    await interaction.response.send_message(text[:2000], ephemeral=True)
+
+def format_census(counts, previous):
+    """One line per owner: `kind count (+delta)`, deltas against the previous /memory_profile census."""
+    lines = []
+    for owner, kinds in counts.items():
+        before = previous.get(owner, {})
+        parts = []
+        for kind, value in kinds.items():
+            shown = format_size(value) if kind.endswith("_bytes") else f"{value:,}"
+            delta = value - before[kind] if kind in before else 0
+            if delta:
+                shown += f" ({format_size(delta, signed=True)})" if kind.endswith("_bytes") else f" ({delta:+,})"
+            parts.append(f"{kind} {shown}")
+        lines.append(f"**{owner or 'process'}:** " + " · ".join(parts))
+    return "\n".join(lines)
+
+def format_sites(title, rows, growth: bool = True):
+    if not rows:
+        return f"**{title}:** nothing grew" if growth else ""
+    lines = [f"**{title}:**"]
+    for row in rows:
+        if growth:
+            site, size_diff, count_diff, size = row
+            lines.append(f"`{format_size(size_diff, signed=True)}` ({count_diff:+,} blocks, now {format_size(size)}) `{site}`")
+        else:
+            site, size, count = row
+            lines.append(f"`{format_size(size)}` ({count:,} blocks) `{site}`")
+    return "\n".join(lines)
+
+@slash_command(name="memory_profile", description="Trace memory growth to source lines and count cached objects (admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    action="status: counts only · start/stop: tracemalloc · snapshot: growth since the last snapshot",
+    frames="Stack depth recorded per allocation when starting (deeper = better attribution, more overhead)"
+)
+@app_commands.choices(action=[app_commands.Choice(name=a, value=a) for a in ("status", "start", "snapshot", "stop")])
+@deferred_command()
+async def memory_profile(interaction: discord.Interaction, action: app_commands.Choice[str],
+                         frames: app_commands.Range[int, 1, 50] = None):
+    action = action.value
+    if action == "start":
+        if memory_profiler.running:
+            await interaction.followup.send("❌ Already profiling. Use `snapshot` or `stop`.", ephemeral=True)
+            return
+        await asyncio.to_thread(memory_profiler.start, frames or MEMORY_PROFILE_FRAMES)
+        logger.info("tracemalloc started by %s (%d frames)", interaction.user.id, memory_profiler.frames)
+        await interaction.followup.send(f"✅ tracemalloc started ({memory_profiler.frames} frames). Run "
+                                        "`/memory_profile snapshot` later to see what grew.", ephemeral=True)
+        return
+    if action in ("snapshot", "stop") and not memory_profiler.running:
+        await interaction.followup.send("❌ Not profiling. Start with `/memory_profile start`.", ephemeral=True)
+        return
+
+    sections = []
+    if action in ("snapshot", "stop"):
+        report = await asyncio.to_thread(memory_profiler.snapshot)
+        if action == "stop":
+            await asyncio.to_thread(memory_profiler.stop)
+            logger.info("tracemalloc stopped by %s", interaction.user.id)
+        sections.append(f"📈 Traced {format_size(report['traced'])}, {format_size(report['growth'], signed=True)} "
+                        f"over the last {report['interval_s'] / 60:.0f} min" + (" · tracemalloc stopped" if action == "stop" else ""))
+        sections.append(format_sites("Growth since last snapshot", report["since_last"]))
+        sections.append(format_sites("Growth since start", report["since_start"][:4]))
+        sections.append(format_sites("Largest now", report["largest"][:4], growth=False))
+    elif memory_profiler.running:
+        traced, peak = tracemalloc.get_traced_memory()
+        # started_at is None when tracing was switched on outside the bot (PYTHONTRACEMALLOC)
+        since = f"since <t:{int(memory_profiler.started_at)}:R>" if memory_profiler.started_at else "from startup via PYTHONTRACEMALLOC"
+        sections.append(f"📈 Profiling {since}, {tracemalloc.get_traceback_limit()} frames: "
+                        f"traced {format_size(traced)}, peak {format_size(peak)}, "
+                        f"overhead {format_size(tracemalloc.get_tracemalloc_memory())}")
+    else:
+        sections.append("📈 tracemalloc is off. `/memory_profile start` to trace allocations.")
+
+    # The invoking tenant's caches plus the process-wide ones; the metrics endpoint has every tenant
+    counts = cache_census()
+    counts = {owner: kinds for owner, kinds in counts.items() if owner in (interaction.client.tenant, "")}
+    counts[""].update(await asyncio.to_thread(heap_census))
+    record_census(counts)
+    census = format_census(counts, memory_profiler.last_census)
+    memory_profiler.last_census = counts
+    header = f"🧠 RSS {format_size(process_rss_bytes())}"
+    await interaction.followup.send("\n".join([header, *filter(None, sections), census])[:2000], ephemeral=True)
 
 # Help
 
-@bot.tree.command(name="help", description="Show help guide for using this bot")
+@slash_command(name="help", description="Show help guide for using this bot")
 @app_commands.checks.has_permissions(administrator=True)
 async def help_command(interaction: discord.Interaction):
     """Display a comprehensive help guide for all bot commands"""
@@ -972,6 +3418,8 @@ async def help_command(interaction: discord.Interaction):
             "`/remove_welcome [index]` - Remove a welcome message by number\n"
             "`/edit_welcome [index] [new_text]` - Edit a welcome message\n"
             "`/test_welcome` - Test the welcome message\n"
+            "`/set_welcome_webhook [url]` - Deliver welcomes through a webhook (`clear` to disable)\n"
+            "`/banner_theme` - Customise banner colours, font, headline and layout (`/banner_theme_reset`)\n"
             "**Placeholders:** `{mention}`, `{username}`, `{server}`"
         ),
         inline=False
@@ -982,6 +3430,8 @@ async def help_command(interaction: discord.Interaction):
         name="🖼️ Embed Creation Commands",
         value=(
             "`/create_embed` - Create and send custom embeds with images\n"
+            "`/broadcast_embed [channels] [group]` - Send the same embed to many channels at once\n"
+            "`/channel_group_save [name] [channels]` - Save a channel group (`/channel_group_list`, `/channel_group_delete`)\n"
             "**Features:** Multiple images, titles, descriptions, footer, author\n"
             "**Modal fields:** Title, Description, Image URLs (one per line), Footer, Message content"
         ),
@@ -992,6 +3442,7 @@ async def help_command(interaction: discord.Interaction):
     help_embed.add_field(
         name="✏️ Embed Editing Commands",
         value=(
+            "`/list_embeds [channel] [since] [until]` - Find sent embeds (and their message IDs), newest first\n"
             "`/edit_embed [message_id] [embed_index]` - Edit existing embeds\n"
             "**Editable fields:** Title, Description, Footer, Color, Image, Thumbnail, Author, Message content\n"
             "**Special:** Use `clear` to remove any field\n"
@@ -1062,7 +3513,7 @@ async def help_command(interaction: discord.Interaction):
             "**GIFs:** Animated GIFs fully supported in embeds\n"
             "**URLs must start with:** `http://` or `https://`\n"
             "**Multiple images:** Enter one URL per line\n"
-            "**Max per message:** 10 images (Discord limit)"
+            "**Max per message:** 10 images (Discord limit); longer lists are split into consecutive messages"
         ),
         inline=False
     )
@@ -1078,6 +3529,16 @@ async def help_command(interaction: discord.Interaction):
         inline=False
     )
     
+    # Diagnostics
+    help_embed.add_field(
+        name="🩺 Diagnostics",
+        value=(
+            "`/loop_stalls` - Handlers that blocked the bot the longest (`show_stack` for details)\n"
+            "`/memory_profile` - Cache/object counts; `start`, `snapshot`, `stop` trace what is growing"
+        ),
+        inline=False
+    )
+
     # Usage Tips
     help_embed.add_field(
         name="💡 Pro Tips",
@@ -1098,15 +3559,56 @@ async def help_command(interaction: discord.Interaction):
 # -----------------------
 # Run
 # -----------------------
+BOT_TOKENS = os.getenv("BOT_TOKENS", "")  # "name=token,name2=token2"; unset runs the single BOT_TOKEN bot
+TENANT_NAME_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+def parse_bot_tokens(text: str):
+    """BOT_TOKENS -> [(name, token)]. The name picks the tenant's storage folder and its env prefix."""
+    entries = []
+    for entry in filter(None, (e.strip() for e in text.split(","))):
+        name, _, token = entry.partition("=")
+        name, token = name.strip(), token.strip()
+        if not TENANT_NAME_RE.fullmatch(name) or not token:
+            raise ValueError(f"BOT_TOKENS entry {name!r} must look like name=token")
+        if any(name == seen for seen, _ in entries):
+            raise ValueError(f"BOT_TOKENS names the tenant {name!r} twice")
+        entries.append((name, token))
+    return entries
+
+def build_tenants():
+    if not BOT_TOKENS:
+        return [WelcomeBot()]
+    return [WelcomeBot(Config(token, env_prefix=name.upper() + "_"), TenantStore(os.path.join(PERSISTENT_PATH, name)), name)
+            for name, token in parse_bot_tokens(BOT_TOKENS)]
+
+async def run_tenant(client: WelcomeBot):
+    # One tenant failing (bad token, fatal gateway error) must not take the others down with it
+    try:
+        async with client:
+            await client.start(client.config.bot_token)
+    except Exception:
+        logger.exception("[%s] Bot stopped", client.tenant)
+
+async def run_tenants(clients):
+    try:
+        await asyncio.gather(*(run_tenant(client) for client in clients))
+    finally:
+        await stop_shared_services()
+
 def main():
     try:
-        bot.config.validate()
+        clients = build_tenants()
+        for client in clients:
+            client.config.validate()
     except Exception as e:
-        logger.error(f"Configuration invalid: {e}")
+        logger.error("Configuration invalid: %s", e)
         return
 
-    token = bot.config.bot_token
-    bot.run(token)
+    # Logging is already routed through setup_logging()'s queue, so discord.py's own handler isn't installed
+    try:
+        asyncio.run(run_tenants(clients))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,188 @@
+"""Offline batch banner renderer.
+
+Renders welcome banners from local avatar files with the same render_welcome_banner() the bot uses, spread over
+a process pool, writing each banner to disk as soon as it is done. No Discord connection (or token) is needed.
+
+Input is a directory of avatar images (name = file stem, member numbers in sorted order) or a manifest:
+JSON Lines with {"avatar": path, "name": str, "member": int, "out": optional file stem}, or a CSV with
+avatar,name,member[,out] columns. Relative avatar paths are resolved against the manifest's directory.
+
+    python render_batch.py avatars/ --out previews/ --theme theme.json
+    python render_batch.py joins.jsonl --out out/ --guild 1281605174556626994 --workers 8
+    python render_batch.py avatars/ --out out/ --guild 1281605174556626994 --tenant community
+    python render_batch.py avatars/ --out out/ --compare golden/ --tolerance 2
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageSequence
+
+import main
+from report_stats import percentiles_ms
+
+AVATAR_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+# -----------------------
+# Job sources
+# -----------------------
+def jobs_from_directory(path: str):
+    files = sorted(f for f in os.listdir(path) if f.lower().endswith(AVATAR_EXTENSIONS))
+    for number, filename in enumerate(files, start=1):
+        stem = os.path.splitext(filename)[0]
+        yield {"avatar": os.path.join(path, filename), "name": stem, "member": number, "out": stem}
+
+def jobs_from_manifest(path: str):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for line_no, row in enumerate(rows, start=1):
+            avatar = os.path.join(base, row["avatar"])
+            yield {
+                "avatar": avatar,
+                "name": row.get("name") or os.path.splitext(os.path.basename(avatar))[0],
+                "member": int(row.get("member") or line_no),
+                "out": row.get("out") or f"{line_no:06d}",
+            }
+
+def load_theme(args) -> dict:
+    if args.theme:
+        with open(args.theme, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if args.guild:
+        path = os.path.join(main.PERSISTENT_PATH, args.tenant) if args.tenant else main.PERSISTENT_PATH
+        return main.TenantStore(path).banner_themes.get(str(args.guild), {})
+    return {}
+
+# -----------------------
+# Worker side (one compiled plan per process)
+# -----------------------
+_plan = None
+
+def _init_worker(theme: dict):
+    global _plan
+    logging.getLogger("WelcomeBot").setLevel(logging.WARNING)
+    _plan = main.compile_banner_theme(theme)
+
+def frames_differ(rendered: bytes, golden_path: str, tolerance: int):
+    """Largest per-channel difference over all frames, or None if it's within tolerance."""
+    with Image.open(BytesIO(rendered)) as new, Image.open(golden_path) as old:
+        if getattr(new, "n_frames", 1) != getattr(old, "n_frames", 1) or new.size != old.size:
+            return "frame count or size differs"
+        worst = 0
+        for a, b in zip(ImageSequence.Iterator(new), ImageSequence.Iterator(old)):
+            extrema = ImageChops.difference(a.convert("RGBA"), b.convert("RGBA")).getextrema()
+            worst = max(worst, max(high for _, high in extrema))
+        return f"max channel difference {worst}" if worst > tolerance else None
+
+def render_job(job: dict, out_dir: str, compare_dir: str, tolerance: int) -> dict:
+    result = {"out": job["out"], "error": None, "mismatch": None, "render_s": 0.0, "bytes": 0}
+    try:
+        with open(job["avatar"], "rb") as f:
+            avatar_bytes = f.read()
+        animate = False
+        if _plan.animated:
+            with Image.open(BytesIO(avatar_bytes)) as probe:
+                animate = getattr(probe, "n_frames", 1) > 1
+        started = time.perf_counter()
+        buffer = main.render_welcome_banner(_plan, avatar_bytes, animate, job["name"], f"Member #{job['member']}")
+        result["render_s"] = time.perf_counter() - started
+        data = buffer.getvalue()
+        filename = job["out"] + os.path.splitext(main.banner_filename(buffer))[1]
+        result["bytes"] = len(data)
+        result["file"] = filename
+        with open(os.path.join(out_dir, filename), "wb") as f:
+            f.write(data)
+        if compare_dir:
+            golden = os.path.join(compare_dir, filename)
+            result["mismatch"] = frames_differ(data, golden, tolerance) if os.path.exists(golden) else "no golden image"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+# -----------------------
+# Driver + report
+# -----------------------
+def run_batch(args) -> dict:
+    os.makedirs(args.out, exist_ok=True)
+    jobs = jobs_from_directory(args.source) if os.path.isdir(args.source) else jobs_from_manifest(args.source)
+    theme = load_theme(args)
+    render_times, results = [], {"rendered": 0, "failed": 0, "mismatched": 0, "bytes": 0}
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(theme,)) as pool:
+        pending = set()
+        # Keep only a few jobs queued per worker so huge manifests stream instead of being submitted up front
+        for job in jobs:
+            pending.add(pool.submit(render_job, job, args.out, args.compare, args.tolerance))
+            if len(pending) >= args.workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result(), results, render_times, args.verbose)
+        for future in wait(pending).done:
+            collect(future.result(), results, render_times, args.verbose)
+
+    elapsed = time.perf_counter() - started
+    render_times.sort()
+    cpu_seconds = sum(render_times)
+    return {
+        **results,
+        "workers": args.workers,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(results["rendered"] / elapsed, 2) if elapsed else 0.0,
+        "per_core_per_s": round(len(render_times) / cpu_seconds, 2) if cpu_seconds else 0.0,
+        "render_ms": percentiles_ms(render_times),
+    }
+
+def collect(result: dict, results: dict, render_times: list, verbose: bool):
+    if result["error"]:
+        results["failed"] += 1
+        print(f"FAILED {result['out']}: {result['error']}", file=sys.stderr)
+        return
+    results["rendered"] += 1
+    results["bytes"] += result["bytes"]
+    render_times.append(result["render_s"])
+    if result["mismatch"]:
+        results["mismatched"] += 1
+        print(f"MISMATCH {result['file']}: {result['mismatch']}", file=sys.stderr)
+    elif verbose:
+        print(f"ok {result['file']} ({result['render_s'] * 1000:.0f} ms)")
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Render welcome banners from local avatars, offline, on a process pool.")
+    parser.add_argument("source", help="directory of avatar images, or a .jsonl / .csv manifest")
+    parser.add_argument("--out", required=True, help="directory to write banners to")
+    theme = parser.add_mutually_exclusive_group()
+    theme.add_argument("--theme", help="JSON file with banner theme overrides (same keys as /banner_theme)")
+    theme.add_argument("--guild", type=int, help="use this guild's saved theme from banner_themes.json")
+    parser.add_argument("--tenant", help="with --guild: the BOT_TOKENS tenant whose storage folder holds the theme")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="render processes")
+    parser.add_argument("--compare", help="golden directory to diff each banner against (same file names)")
+    parser.add_argument("--tolerance", type=int, default=0, help="largest per-channel difference still counted as a match")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="print every rendered file")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("WelcomeBot").setLevel(logging.WARNING)
+    report = run_batch(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        lat = report["render_ms"]
+        print(f"Rendered: {report['rendered']}  failed: {report['failed']}  mismatched: {report['mismatched']}  "
+              f"({report['bytes'] / 2**20:.1f} MB) in {report['elapsed_s']}s on {report['workers']} worker(s)")
+        print(f"Throughput: {report['throughput_per_s']}/s wall, {report['per_core_per_s']}/s per core")
+        print(f"Render ms: p50 {lat['p50']}  p90 {lat['p90']}  p99 {lat['p99']}  max {lat['p100']}")
+    return 1 if report["failed"] or report["mismatched"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
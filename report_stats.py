@@ -0,0 +1,14 @@
+"""Small helpers shared by the offline tools (loadtest.py, render_batch.py); the bot itself doesn't import this."""
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def percentiles_ms(sorted_seconds, points=("p50", "p90", "p99", "p100")):
+    """{"p50": ms, ...} for a sorted list of durations in seconds, rounded to 0.1 ms."""
+    return {p: round(percentile(sorted_seconds, float(p[1:])) * 1000, 1) for p in points}
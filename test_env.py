@@ -5,3 +5,7 @@ load_dotenv()
 print("BOT_TOKEN:", os.getenv('BOT_TOKEN'))
 print("WEBHOOK_URL:", os.getenv('WEBHOOK_URL'))
 print("GUILD_ID:", os.getenv('GUILD_ID'))
+# Only the tenant names: the tokens themselves stay off stdout
+tenants = [e.partition("=") for e in (e.strip() for e in os.getenv('BOT_TOKENS', '').split(",")) if e]
+print("BOT_TOKENS tenants:", ", ".join(name.strip() for name, _, _ in tenants) or None)
+print("BOT_TOKENS tokens set:", sum(1 for _, _, token in tenants if token.strip()))